@@ -28,29 +28,652 @@ import sys
 sys.path.append('./lib')
 
 import gettext
+import logging
+import queue
+import socket
+import tempfile
 import threading
+import time
+import zipfile
 import zoe
-from infocards.archive import Archive
+from caches import ArchiveCache
+from cardfiles import (export_cards, format_markdown, guess_format,
+    load_card, read_cards, write_cards)
+from contextlib import contextmanager, suppress
+from functools import wraps
+from itertools import chain
+from metrics import Metrics
 from os import environ as env
+from os import makedirs, stat, unlink
+from os.path import abspath, isabs, realpath, sep, split
 from os.path import join as path
+from types import SimpleNamespace
 from zoe.deco import Agent, Message
 from zoe.models.users import Users
 
-gettext.install("archivist")
 
-with open(path(env["ZOE_HOME"], "etc", "archivist.conf"), "r") as f:
-    DB_PATH = f.readline().strip()
+def read_conf(conf_path):
+    """ Read the configuration file of the agent.
+
+        The first line is always the path to the database. Any other
+        non-empty line is an option in the form 'key = value'.
+    """
+    options = {}
+
+    with open(conf_path, "r") as f:
+        db_path = f.readline().strip()
+
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+
+            key, value = line.split("=", 1)
+            options[key.strip()] = value.strip()
+
+    return db_path, options
+
+
+class RWLock:
+    """ Readers-writer lock.
+
+        Any number of readers may hold the lock at the same time, while
+        writers are given exclusive access. Waiting writers are given
+        priority over new readers so that mutations are not starved by
+        a steady stream of searches.
+
+        If 'exclusive' is set, readers are serialized as well, which is
+        equivalent to a plain lock.
+
+        If given, 'on_wait' is called with the seconds spent waiting
+        every time the lock is acquired.
+
+        The thread that holds the lock for writing may acquire it again,
+        for reading or writing, without waiting.
+    """
+
+    def __init__(self, exclusive=False, on_wait=None):
+        self._cond = threading.Condition(threading.Lock())
+        self._exclusive = exclusive
+        self._on_wait = on_wait
+        self._owner = None
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """ Acquire the lock for a read-only operation. """
+        if self._exclusive or self._owner == threading.get_ident():
+            with self.write():
+                yield
+            return
+
+        start = time.perf_counter()
+
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+        if self._on_wait:
+            self._on_wait(time.perf_counter() - start)
+
+        try:
+            yield
+
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Acquire the lock for an operation that modifies the archive. """
+        if self._owner == threading.get_ident():
+            yield
+            return
+
+        start = time.perf_counter()
+
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+            self._owner = threading.get_ident()
+
+        if self._on_wait:
+            self._on_wait(time.perf_counter() - start)
+
+        try:
+            yield
+
+        finally:
+            with self._cond:
+                self._owner = None
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ArchivePool:
+    """ Long-lived archive shared by every handler.
+
+        The archive (and therefore the database setup) is created only
+        once. Each handler checks out a connection for the duration of
+        the request and at most 'size' connections are in use at the
+        same time. A size of 0 disables pooling and opens a new archive
+        for every request.
+
+        A thread that already has a connection checked out obtains the
+        same one again, so that nested calls share its transaction.
+
+        The archive module, and with it infocards and peewee, is only
+        imported when the first archive is created, so that the agent
+        starts without loading them.
+    """
+
+    def __init__(self, db_path, size=4, check_after=60, wal=False,
+        cache=None):
+        self._db_path = db_path
+        self._size = size
+        self._check_after = check_after
+        self._wal = wal
+        self._cache = cache
+        self._archive = None
+        self._init_lock = threading.Lock()
+        self._local = threading.local()
+
+        if size:
+            self._slots = threading.BoundedSemaphore(size)
+
+    def archive(self):
+        """ Obtain the shared archive, creating it if needed. """
+        if self._archive is None:
+            with self._init_lock:
+                if self._archive is None:
+                    self._archive = self._create(self._size)
+
+        return self._archive
+
+    @contextmanager
+    def connection(self):
+        """ Check out a connection to the archive for the current thread. """
+        if not self._size:
+            yield self._create(0)
+            return
+
+        if getattr(self._local, "archive", None):
+            yield self._local.archive
+            return
+
+        with self._slots:
+            ar = self._local.archive = self.archive()
+
+            try:
+                yield ar
+
+            finally:
+                self._local.archive = None
+
+                if not ar.db.is_closed():
+                    ar.db.close()
+
+    def _create(self, size):
+        """ Create a new archive with the given connection pool size. """
+        from store import AgentArchive
+
+        return AgentArchive(
+            db_type="sqlite",
+            db_name=self._db_path,
+            pool_size=size,
+            pool_check=self._check_after,
+            wal=self._wal,
+            cache=self._cache)
+
+
+class UserDirectory:
+    """ In-memory view of the users known to Zoe.
+
+        Members of the 'archivists' group and the configuration of every
+        subject that has been looked up are kept in memory. Everything is
+        discarded when the modification time of zoe-users.conf changes.
+    """
+
+    def __init__(self, conf_path, group="archivists"):
+        self._conf_path = conf_path
+        self._group = group
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._users = None
+        self._members = frozenset()
+        self._subjects = {}
+
+    def is_member(self, user):
+        """ Check if the user belongs to the group of archivists. """
+        self._refresh()
+        return user in self._members
+
+    def locale(self, user, default):
+        """ Obtain the locale of the user. """
+        return self.subject(user).get("locale", default)
+
+    def preferred(self, user, default):
+        """ Obtain the preferred communication channel of the user. """
+        return self.subject(user).get("preferred", default)
+
+    def subject(self, user):
+        """ Obtain the configuration of the given user. """
+        self._refresh()
+
+        conf = self._subjects.get(user)
+        if conf is None:
+            with self._lock:
+                conf = dict(self._users.subject(user))
+                self._subjects[user] = conf
+
+        return conf
+
+    def _refresh(self):
+        """ Reload the users if the configuration file has changed. """
+        try:
+            mtime = stat(self._conf_path).st_mtime
+
+        except OSError:
+            mtime = None
+
+        if self._users is not None and mtime == self._mtime:
+            return
+
+        with self._lock:
+            if self._users is not None and mtime == self._mtime:
+                return
+
+            users = Users()
+            self._members = frozenset(users.membersof(self._group))
+            self._subjects = {}
+            self._users = users
+            self._mtime = mtime
+
+
+class Catalogs:
+    """ Translation catalogs of the agent, loaded once per locale. """
+
+    def __init__(self, localedir):
+        self._localedir = localedir
+        self._lock = threading.Lock()
+        self._catalogs = {}
+
+    def get(self, locale):
+        """ Obtain the catalog for the given locale.
+
+            Falls back to the original strings if there is no catalog for
+            the locale.
+        """
+        catalog = self._catalogs.get(locale)
+
+        if catalog is None:
+            with self._lock:
+                catalog = gettext.translation("archivist",
+                    localedir=self._localedir, languages=[locale,],
+                    fallback=True)
+                self._catalogs[locale] = catalog
+
+        return catalog
+
+
+class Dispatcher:
+    """ Runs handlers in a bounded pool of worker threads.
+
+        Each worker has its own queue. Mutations are always assigned to
+        the worker that corresponds to their sender, so that they are
+        applied in the order they were received, while read-only
+        handlers go to the least busy worker. When the queue of a worker
+        is full, new messages wait until there is room for them.
+
+        Whatever the handler returns is sent to the Zoe server as soon as
+        it finishes.
+    """
+
+    def __init__(self, workers, queue_size, send):
+        self._send = send
+        self._local = threading.local()
+        self._lanes = [queue.Queue(queue_size) for _ in range(workers)]
+
+        for lane in self._lanes:
+            worker = threading.Thread(target=self._work, args=(lane,))
+            worker.daemon = True
+            worker.start()
+
+    def in_worker(self):
+        """ Check if the current thread is one of the workers. """
+        return getattr(self._local, "worker", False)
+
+    def submit(self, func, args, sender=None, mutation=False):
+        """ Queue a handler call, blocking while the queue is full. """
+        if mutation:
+            lane = self._lanes[hash(sender) % len(self._lanes)]
+
+        else:
+            # Includes the message being handled by the worker
+            lane = min(self._lanes, key=lambda q: q.unfinished_tasks)
+
+        lane.put((func, args))
+
+    def _work(self, lane):
+        self._local.worker = True
+
+        while True:
+            func, args = lane.get()
+
+            try:
+                replies = func(*args)
+
+                if not isinstance(replies, (list, tuple)):
+                    replies = (replies,)
+
+                for reply in replies:
+                    if reply:
+                        self._send(reply)
+
+            except Exception:
+                logging.getLogger("archivist").exception(
+                    "Failed to run %s" % func.__name__)
+
+            finally:
+                lane.task_done()
+
+
+class WriteBatcher:
+    """ Runs mutating handlers in a single thread, grouping the ones that
+        arrive within 'window' seconds of each other in a single
+        transaction so that they share one commit.
+
+        Each handler runs in its own savepoint, so one that fails does
+        not undo the rest. Replies are sent once the transaction has been
+        committed. If the commit fails, 'fail' is called with the batch
+        and the error, and whatever it returns is sent instead.
+    """
+
+    # Maximum number of handlers in a single transaction
+    MAX_BATCH = 100
+
+    def __init__(self, window, queue_size, send, lock, connect, fail):
+        self._window = window
+        self._send = send
+        self._lock = lock
+        self._connect = connect
+        self._fail = fail
+        self._local = threading.local()
+        self._queue = queue.Queue(queue_size)
+
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+
+    def in_worker(self):
+        """ Check if the current thread is the writer. """
+        return getattr(self._local, "worker", False)
+
+    def submit(self, func, args):
+        """ Queue a handler call, blocking while the queue is full. """
+        self._queue.put((func, args))
+
+    def _run(self, batch):
+        """ Run a batch of handlers and commit them together. """
+        replies = []
+
+        try:
+            with self._lock.write(), self._connect() as ar:
+                with ar.db.atomic():
+                    for func, args in batch:
+                        try:
+                            with ar.db.atomic():
+                                replies.append(func(*args))
+
+                        except Exception:
+                            logging.getLogger("archivist").exception(
+                                "Failed to run %s" % func.__name__)
+
+        except Exception as e:
+            logging.getLogger("archivist").exception(
+                "Failed to commit %d changes" % len(batch))
+            replies = self._fail(batch, e)
+
+        return replies
+
+    def _work(self):
+        self._local.worker = True
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self._window
+
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(deadline - time.perf_counter(), 0)))
+
+                except queue.Empty:
+                    break
+
+            for replies in self._run(batch):
+                if not isinstance(replies, (list, tuple)):
+                    replies = (replies,)
+
+                for reply in replies:
+                    if reply:
+                        try:
+                            self._send(reply)
+
+                        except Exception:
+                            logging.getLogger("archivist").exception(
+                                "Failed to send reply")
+
+            for _ in batch:
+                self._queue.task_done()
+
+
+class RelatedUpdater:
+    """ Keeps the related cards index up to date in a background thread.
+
+        The thread wakes up when notify() is called and updates the
+        pending cards in batches of at most 'batch' cards. Each batch is
+        a transaction of its own, run while holding the lock for writing,
+        so handlers never wait for more than a single batch and the
+        handler that answers with related cards never updates them.
+
+        Batches are measured as 'related_update' in the statistics.
+    """
+
+    def __init__(self, batch, lock, connect, metrics):
+        self._batch = batch
+        self._lock = lock
+        self._connect = connect
+        self._metrics = metrics
+        self._wake = threading.Event()
+
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+
+    def notify(self):
+        """ Update the pending cards as soon as possible. """
+        self._wake.set()
+
+    def _run(self):
+        """ Update a batch of pending cards.
+
+            Returns True if there may be more pending cards.
+        """
+        with self._metrics.measure("related_update"), self._lock.write():
+            with self._metrics.timer("db"), self._connect() as ar:
+                if not ar.related_index.available:
+                    return False
+
+                return ar.related_index.update(self._batch) >= self._batch
+
+    def _work(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+
+            try:
+                while self._run():
+                    pass
+
+            except Exception:
+                logging.getLogger("archivist").exception(
+                    "Failed to update the related cards")
+
+
+def batch_failed(batch, error):
+    """ Reply to every handler of a batch that could not be committed.
+
+        Cached information may come from the changes that were lost, so
+        every cache is cleared.
+    """
+    for name, cache in CACHE.all():
+        cache.clear()
+
+    return [agent.feedback("Error: " + str(error), parser.get("sender"),
+        parser.get("src")) for func, (agent, parser) in batch]
+
+
+def sendbus(message):
+    """ Send a message to the Zoe server. """
+    host = env.get("ZOE_SERVER_HOST", "localhost")
+    port = int(env.get("ZOE_SERVER_PORT", 30000))
+
+    with socket.create_connection((host, port)) as conn:
+        conn.sendall(message.msg().encode("utf-8"))
+
+
+def dispatch(mutation=False):
+    """ Run the decorated handler in the dispatcher, if it is enabled.
+
+        Mutations are run by the writer instead when commits are grouped.
+        Handlers that are called from a worker (for instance, by another
+        handler) are run directly. Every call is measured, and every
+        mutation wakes up the updater of the related cards. Handlers
+        start a new generation of the archive themselves (see
+        ArchiveCache), before releasing the lock.
+    """
+    def decorator(func):
+        @wraps(func)
+        def measured(self, parser):
+            try:
+                with METRICS.measure(func.__name__):
+                    return func(self, parser)
+
+            finally:
+                if mutation:
+                    RELATED.notify()
+
+        @wraps(func)
+        def wrapper(self, parser):
+            if mutation and WRITER and not WRITER.in_worker():
+                WRITER.submit(measured, (self, parser))
+                return
+
+            if not DISPATCHER or DISPATCHER.in_worker():
+                return measured(self, parser)
+
+            DISPATCHER.submit(measured, (self, parser),
+                sender=parser.get("sender"), mutation=mutation)
+
+        return wrapper
+
+    return decorator
+
+
+DB_PATH, CONF = read_conf(path(env["ZOE_HOME"], "etc", "archivist.conf"))
 
 LOCALEDIR = path(env["ZOE_HOME"], "locale")
 ZOE_LOCALE = env["ZOE_LOCALE"] or "en"
 
-LOCK = threading.Lock()
+CATALOGS = Catalogs(LOCALEDIR)
+
+METRICS = Metrics()
+
+# Locking mode: 'rw' lets read-only handlers run in parallel, 'global'
+# serializes every handler
+LOCK = RWLock(exclusive=CONF.get("lock", "rw") == "global",
+    on_wait=lambda seconds: METRICS.add_time("lock", seconds))
+
+# Milliseconds to wait for more mutations to commit them together.
+# Disabled when 0, requires the connection pool
+GROUP_COMMIT = int(CONF.get("group_commit", 0))
+
+CACHE = ArchiveCache(int(CONF.get("cache_size", 1000)))
+
+POOL = ArchivePool(DB_PATH,
+    size=int(CONF.get("pool_size", 4)),
+    check_after=int(CONF.get("pool_check", 60)),
+    wal=CONF.get("wal", "yes" if GROUP_COMMIT else "no") == "yes",
+    cache=CACHE)
+
+# Default number of results in listings
+PAGE_SIZE = int(CONF.get("page_size", 50))
+
+# Maximum size of a single reply sent through a chat channel
+MAX_MSG_SIZE = int(CONF.get("max_msg_size", 4000))
+
+# Cards sent by mail are attached as a file if their text is longer than
+# 'attachment_size' characters (0 to never attach them), either as 'txt'
+# or as a 'zip' of Markdown files
+ATTACHMENT_SIZE = int(CONF.get("attachment_size", 100000))
+ATTACHMENT_FORMAT = CONF.get("attachment_format", "zip")
+
+# Directory where the 'export' command writes its files
+EXPORT_DIR = CONF.get("export_dir", path(env["ZOE_HOME"], "var", "archivist"))
+
+# Last paginated listing requested by each sender, used by 'next-page'
+PAGES = {}
+
+USERS = UserDirectory(path(env["ZOE_HOME"], "etc", "zoe-users.conf"))
+
+# Asynchronous mode: handlers run in 'async_workers' threads and replies
+# are sent when ready. Disabled when 0
+DISPATCHER = None
+if int(CONF.get("async_workers", 0)):
+    DISPATCHER = Dispatcher(
+        int(CONF["async_workers"]),
+        int(CONF.get("async_queue", 100)),
+        sendbus)
+
+WRITER = None
+if GROUP_COMMIT and int(CONF.get("pool_size", 4)):
+    WRITER = WriteBatcher(
+        GROUP_COMMIT / 1000,
+        int(CONF.get("async_queue", 100)),
+        sendbus,
+        LOCK,
+        POOL.connection,
+        batch_failed)
+
+# Maximum number of cards whose related cards are updated at once, while
+# every other handler waits
+RELATED = RelatedUpdater(
+    int(CONF.get("related_batch", 100)),
+    LOCK,
+    POOL.connection,
+    METRICS)
+
+# Seconds between dumps of the handler statistics to the log. Disabled
+# when 0
+if int(CONF.get("stats_interval", 0)):
+    METRICS.start_dump(int(CONF["stats_interval"]),
+        logging.getLogger("archivist"))
 
 
 @Agent(name="archivist")
 class Archivist:
 
     @Message(tags=["add-section"])
+    @dispatch(mutation=True)
     def add_card_to_section(self, parser):
         """ Adds a card to the given section.
 
@@ -62,17 +685,18 @@ class Archivist:
         cid, sname, sender, src = self.multiparse(
             parser, ['cid', 'sname', 'sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not self.has_permissions(sender):
             self.logger.info("%s cannot modify section relations" % sender)
             return self.feedback(_("You don't have permissions to do that"),
                 sender, src)
 
-        with LOCK:
+        with LOCK.write():
             try:
-                ar = self.connect()
-                result = ar.add_card_to_section(cid=int(cid), sname=sname)
+                with self.connect() as ar:
+                    result = ar.add_card_to_section(cid=int(cid), sname=sname)
+                    CACHE.relation_changed(int(cid))
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -85,36 +709,43 @@ class Archivist:
             _("Failed to add card to section '%s'") % sname, sender, src)
 
     @Message(tags=["card-list"])
+    @dispatch(mutation=False)
     def card_list(self, parser):
         """ List all the cards in the archive.
 
             sender* - sender of the message
             src*    - channel by which the message was delivered
+            limit   - maximum number of cards to show
+            offset  - number of cards to skip
         """
-        sender, src = self.multiparse(parser, ['sender', 'src'])
-
-        self.set_locale(sender)
+        sender, src, limit, offset = self.multiparse(
+            parser, ['sender', 'src', 'limit', 'offset'])
 
-        msg = ""
+        _ = self.get_translation(sender)
 
-        with LOCK:
+        with LOCK.read():
             try:
-                ar = self.connect()
-                cards = ar.cards()
+                limit, offset = self.page_args(limit, offset)
 
-                for card in cards:
-                    msg += "- [%d] %s: %s\n" % (
-                        card.id, card.title, card.desc)
+                with self.connect() as ar:
+                    # One more card to know if there is a next page
+                    cards = ar.card_rows(limit=limit + 1, offset=offset)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
 
-        if not msg:
-            msg = _("No cards found")
+        lines = list(self.card_lines(cards[:limit]))
+
+        if not lines:
+            lines.append(_("No cards found"))
 
-        return self.feedback(msg, sender, src)
+        lines.append(self.remember_page(_, len(cards) > limit, "card_list", {
+            "sender": sender, "limit": limit, "offset": offset + limit}))
+
+        return self.split_feedback(lines, sender, src)
 
     @Message(tags=["card-sections"])
+    @dispatch(mutation=False)
     def card_sections(self, parser):
         """ Show all the sections a card appears in.
 
@@ -125,32 +756,30 @@ class Archivist:
         cid, sender, src = self.multiparse(
             parser, ['cid', 'sender', 'src'])
 
-        self.set_locale(sender)
-
-        msg = ""
+        _ = self.get_translation(sender)
 
-        with LOCK:
+        with LOCK.read():
             try:
-                ar = self.connect()
-                card = ar.get_card(cid=int(cid))
+                with self.connect() as ar:
+                    card = ar.get_card(cid=int(cid))
 
-                if not card:
-                    return self.feedback(_("Card %s does not exist") % cid,
-                        sender, src)
+                    if not card:
+                        return self.feedback(_("Card %s does not exist") % cid,
+                            sender, src)
 
-                sections = card.sections()
-                for section in sections:
-                    msg += "- %s\n" % section.name
+                    lines = ["- %s\n" % name
+                        for name in ar.card_section_names(card.id)]
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
 
-        if not msg:
-            msg = _("No sections found")
+        if not lines:
+            lines.append(_("No sections found"))
 
-        return self.feedback(msg, sender, src)
+        return self.split_feedback(lines, sender, src)
 
     @Message(tags=["delete-card"])
+    @dispatch(mutation=True)
     def delete_card(self, parser):
         """ Remove a card from the archive.
 
@@ -161,17 +790,18 @@ class Archivist:
         cid, sender, src = self.multiparse(
             parser, ['cid', 'sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not self.has_permissions(sender):
             self.logger.info("%s cannot remove cards" % sender)
             return self.feedback(_("You don't have permissions to do that"),
                 sender, src)
 
-        with LOCK:
+        with LOCK.write():
             try:
-                ar = self.connect()
-                result = ar.delete_card(cid=int(cid))
+                with self.connect() as ar:
+                    result = ar.delete_card(cid=int(cid))
+                    CACHE.card_deleted(int(cid))
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -183,6 +813,7 @@ class Archivist:
         return self.feedback(_("Failed to remove card '%s'") % cid, sender, src)
 
     @Message(tags=["delete-section"])
+    @dispatch(mutation=True)
     def delete_section(self, parser):
         """ Remove a section from the archive.
 
@@ -193,17 +824,18 @@ class Archivist:
         name, sender, src = self.multiparse(
             parser, ['name', 'sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not self.has_permissions(sender):
             self.logger.info("%s cannot remove cards" % sender)
             return self.feedback(_("You don't have permissions to do that"),
                 sender, src)
 
-        with LOCK:
+        with LOCK.write():
             try:
-                ar = self.connect()
-                result = ar.delete_section(name=name)
+                with self.connect() as ar:
+                    result = ar.delete_section(name=name)
+                    CACHE.sections_changed(name)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -214,7 +846,50 @@ class Archivist:
 
         return self.feedback(_("Failed to remove '%s'") % name, sender, src)
 
+    @Message(tags=["export"])
+    @dispatch(mutation=False)
+    def export(self, parser):
+        """ Write the cards in the archive to a file, one at a time, so
+            that big archives can be exported in constant memory.
+
+            JSON lines files can be imported again with 'import-cards'.
+
+            file*   - name of the file to write, relative to EXPORT_DIR
+            format  - 'jsonl' or 'md' (Markdown), guessed from the
+                      extension of the file if not given
+            section - only export the cards in this section
+            tag     - only export the cards with this tag
+            sender  - sender of the message
+            src     - channel by which the message was delivered
+        """
+        file_path, fmt, sname, tag, sender, src = self.multiparse(
+            parser, ['file', 'format', 'section', 'tag', 'sender', 'src'])
+
+        _ = self.get_translation(sender)
+
+        if not self.has_permissions(sender):
+            self.logger.info("%s cannot export cards" % sender)
+            return self.feedback(_("You don't have permissions to do that"),
+                sender, src)
+
+        with LOCK.read():
+            try:
+                dst_path = self.export_path(file_path or "")
+
+                with self.connect() as ar:
+                    count = write_cards(
+                        dst_path,
+                        export_cards(ar.db.execute_sql, sname, tag),
+                        fmt or guess_format(dst_path))
+
+            except Exception as e:
+                return self.feedback("Error: " + str(e), sender, src)
+
+        return self.feedback(_("Exported %d cards to %s") % (
+            count, file_path), sender, src)
+
     @Message(tags=["get-cards"])
+    @dispatch(mutation=False)
     def get_cards(self, parser):
         """ Obtain information from a list of cards and send it to the user
             through the chosen communication method.
@@ -228,23 +903,30 @@ class Archivist:
         cids, method, sender, src, to = self.multiparse(
             parser, ['cids', 'method', 'sender', 'src', 'to'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
-        with LOCK:
+        with LOCK.read():
             try:
-                ar = self.connect()
+                ids = [int(cid) for cid in cids.split()]
 
-                msg = ""
+                with self.connect() as ar:
+                    if method == "mail":
+                        cards = dict((card["id"], card) for card in
+                            export_cards(ar.db.execute_sql, cids=ids))
 
-                for cid in cids.split(" "):
-                    card = ar.get_card(cid=int(cid))
+                        msg, att = self.mail_cards(_, (
+                            cards[cid] if cid in cards
+                            else _("Card %s not found") % cid + "\n"
+                            for cid in ids))
 
-                    if card:
-                        msg += "%s\n\n" % self.build_card_msg(card)
-                        continue
+                    else:
+                        cards = ar.get_cards(ids)
 
-                    msg += _("Card %s not found") % cid
-                    msg += "\n"
+                        chunks = (
+                            self.build_card_msg(cards[cid]) + "\n\n"
+                            if cid in cards
+                            else _("Card %s not found") % cid + "\n"
+                            for cid in ids)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -255,12 +937,13 @@ class Archivist:
         if method == "mail":
             return (
                 self.feedback(_("Sending..."), sender, src),
-                self.feedback(msg, to, subject="Archivist")
+                self.feedback(msg, to, subject="Archivist", att=att)
             )
 
-        return self.feedback(msg, to, src)
+        return self.split_feedback(chunks, to, src)
 
     @Message(tags=["get-section"])
+    @dispatch(mutation=False)
     def get_section(self, parser):
         """ Obtain information from the cards contained in a given section.
 
@@ -273,22 +956,27 @@ class Archivist:
         sname, method, sender, src, to = self.multiparse(
             parser, ['sname', 'method', 'sender', 'src', 'to'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
-        with LOCK:
+        with LOCK.read():
             try:
-                ar = self.connect()
-                section = ar.get_section(name=sname)
+                with self.connect() as ar:
+                    section = ar.get_section(name=sname)
 
-                if not section:
-                    return self.feedback(
-                        _("Section %s does not exist") % sname, sender, src)
+                    if not section:
+                        return self.feedback(
+                            _("Section %s does not exist") % sname,
+                            sender, src)
 
-                cards = section.cards()
+                    if method == "mail":
+                        # Single mail, joined once or attached
+                        msg, att = self.mail_cards(_, export_cards(
+                            ar.db.execute_sql, section=sname))
 
-                msg = ""
-                for card in cards:
-                    msg += "%s\n\n" % self.build_card_msg(card)
+                    else:
+                        messages = self.split_feedback(
+                            self.card_msgs(ar.section_cards(section.id)),
+                            to or sender, src)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -299,12 +987,83 @@ class Archivist:
         if method == "mail":
             return (
                 self.feedback(_("Sending..."), sender, src),
-                self.feedback(msg, to, subject="Archivist")
+                self.feedback(msg, to, subject="Archivist", att=att)
             )
 
-        return self.feedback(msg, to, src)
+        return messages
+
+    @Message(tags=["import-cards"])
+    @dispatch(mutation=True)
+    def import_cards(self, parser):
+        """ Add several cards to the archive at once, reading them from a
+            file. Every card is added in the same transaction.
+
+            Missing sections are created and the outcome of every card is
+            reported.
+
+            file*   - path to the CSV or JSON lines file with the cards
+            format  - 'csv' or 'jsonl', guessed from the extension of the
+                      file if not given
+            remove  - 'yes' to remove the file once it has been read, only
+                      for files of the mail processor (see is_handoff)
+            sender  - sender of the message
+        """
+        file_path, fmt, remove, sender = self.multiparse(
+            parser, ['file', 'format', 'remove', 'sender'])
+
+        _ = self.get_translation(sender)
+
+        dst = None
+        subject = None
+        if sender:
+            dst = USERS.preferred(sender, "mail")
+
+            if dst == "mail":
+                subject = "Archivist"
+
+        with self.handoff(file_path, remove):
+            if not self.has_permissions(sender):
+                self.logger.info("%s cannot import cards" % sender)
+                return self.feedback(
+                    _("You don't have permissions to do that"),
+                    sender, dst, subject=subject)
+
+            with LOCK.write():
+                try:
+                    with self.connect() as ar, open(file_path, "r") as f:
+                        results = ar.import_cards(
+                            read_cards(f, fmt or guess_format(file_path)),
+                            sender or "UNKNOWN")
+
+                        CACHE.sections_changed()
+
+                        for title, cid, error in results:
+                            if cid:
+                                CACHE.relation_changed(cid)
+
+                except Exception as e:
+                    return self.feedback("Error: " + str(e), sender, dst,
+                        subject=subject)
+
+        imported = sum(1 for title, cid, error in results if cid)
+
+        lines = [_("Imported %d of %d cards") % (imported, len(results))
+            + "\n\n"]
+
+        for title, cid, error in results:
+            if cid:
+                lines.append("- [%d] %s\n" % (cid, title))
+
+            else:
+                lines.append("- %s: %s\n" % (title, error))
+
+        if subject:
+            return self.feedback("".join(lines), sender, subject=subject)
+
+        return self.split_feedback(lines, sender, dst)
 
     @Message(tags=["modify-card"])
+    @dispatch(mutation=True)
     def modify_card(self, parser):
         """ Modify an existing card.
 
@@ -313,46 +1072,49 @@ class Archivist:
             desc    - description of the card
             content - main content of the card
             tags    - space separated tags
+            file    - JSON file with the fields to modify (see card_fields)
+            remove  - 'yes' to remove the file once it has been read, only
+                      for files of the mail processor (see is_handoff)
             sender  - sender of the message
             src     - channel by which the message was delivered
         """
-        cid, title, desc, content, tags, sender, src= self.multiparse(
-            parser, ['cid', 'title', 'desc', 'content', 'tags',
-                'sender', 'src'])
-
-        self.set_locale(sender)
-
-        if not self.has_permissions(sender):
-            self.logger.info("%s cannot create sections" % sender)
-            return self.feedback(_("You don't have permissions to do that"),
-                sender, src)
-
-        with LOCK:
-            try:
-                ar = self.connect()
-
-                # Obtain current information
-                card = ar.get_card(cid=int(cid))
-
-                newcard = ar.modify_card(
-                    cid=int(cid),
-                    title=title or card.title,
-                    desc=desc or card.desc,
-                    content=content.replace('_NL_', '\n'),
-                    tags=tags or card.tags,
-                    author=sender or "UNKNOWN"
-                )
-
-            except Exception as e:
-                return self.feedback("Error: " + str(e), sender, src)
-
-        if newcard:
+        cid, sender, src, file_path, remove = self.multiparse(
+            parser, ['cid', 'sender', 'src', 'file', 'remove'])
+
+        _ = self.get_translation(sender)
+
+        with self.handoff(file_path, remove):
+            if not self.has_permissions(sender):
+                self.logger.info("%s cannot create sections" % sender)
+                return self.feedback(
+                    _("You don't have permissions to do that"), sender, src)
+
+            with LOCK.write():
+                try:
+                    title, desc, content, tags = self.card_fields(parser)
+
+                    with self.connect() as ar:
+                        modified = ar.update_card(
+                            int(cid),
+                            author=sender or "UNKNOWN",
+                            title=title,
+                            desc=desc,
+                            content=content,
+                            tags=tags
+                        )
+                        CACHE.card_changed(int(cid))
+
+                except Exception as e:
+                    return self.feedback("Error: " + str(e), sender, src)
+
+        if modified:
             return self.feedback(_("Modified card '%s'") % cid, sender, src)
 
         return self.feedback(_("Failed to modify card '%s'") % cid,
             sender, src)
 
     @Message(tags=["new-card"])
+    @dispatch(mutation=True)
     def new_card(self, parser):
         """ Add a new card to the archive. Cards are added by sending
             an email with a specific format.
@@ -363,41 +1125,49 @@ class Archivist:
             desc*    - description of the card
             content* - main content of the card
             tags*    - space separated tags
+            file     - JSON file with the fields instead (see card_fields)
+            remove   - 'yes' to remove the file once it has been read, only
+                       for files of the mail processor (see is_handoff)
             sender   - sender of the message
         """
-        title, desc, content, tags, sender = self.multiparse(
-            parser, ['title', 'desc', 'content', 'tags', 'sender'])
+        sender, file_path, remove = self.multiparse(
+            parser, ['sender', 'file', 'remove'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         dst = None
         subject = None
         if sender:
-            dst = Users().subject(sender).get("preferred", "mail")
+            dst = USERS.preferred(sender, "mail")
 
             if dst == "mail":
                 subject = "Archivist"
 
-        if not self.has_permissions(sender):
-            self.logger.info("%s cannot add cards" % sender)
-            return self.feedback(_("You don't have permissions to do that"),
-                sender, dst, subject=subject)
+        with self.handoff(file_path, remove):
+            if not self.has_permissions(sender):
+                self.logger.info("%s cannot add cards" % sender)
+                return self.feedback(
+                    _("You don't have permissions to do that"),
+                    sender, dst, subject=subject)
 
-        with LOCK:
-            try:
-                ar = self.connect()
+            with LOCK.write():
+                try:
+                    title, desc, content, tags = self.card_fields(parser)
 
-                newcard = ar.new_card(
-                    title,
-                    desc,
-                    content.replace('_NL_', '\n'),
-                    tags,
-                    sender or "UNKNOWN"
-                )
+                    with self.connect() as ar:
 
-            except Exception as e:
-                return self.feedback("Error: " + str(e), sender, dst,
-                    subject=subject)
+                        newcard = ar.new_card(
+                            title,
+                            desc,
+                            content,
+                            tags,
+                            sender or "UNKNOWN"
+                        )
+                        CACHE.archive_changed()
+
+                except Exception as e:
+                    return self.feedback("Error: " + str(e), sender, dst,
+                        subject=subject)
 
         if newcard:
             return self.feedback(
@@ -408,6 +1178,7 @@ class Archivist:
             subject=subject)
 
     @Message(tags=["new-section"])
+    @dispatch(mutation=True)
     def new_section(self, parser):
         """ Create a new section in the archive.
 
@@ -418,17 +1189,18 @@ class Archivist:
         name, sender, src = self.multiparse(
             parser, ['name', 'sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not self.has_permissions(sender):
             self.logger.info("%s cannot create sections" % sender)
             return self.feedback(_("You don't have permissions to do that"),
                 sender, src)
 
-        with LOCK:
+        with LOCK.write():
             try:
-                ar = self.connect()
-                result = ar.new_section(name)
+                with self.connect() as ar:
+                    result = ar.new_section(name)
+                    CACHE.sections_changed()
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -440,7 +1212,79 @@ class Archivist:
         return self.feedback(_("Could not create section '%s'") % name,
             sender, src)
 
+    @Message(tags=["next-page"])
+    @dispatch(mutation=False)
+    def next_page(self, parser):
+        """ Show the next page of the last listing requested by the sender.
+
+            sender* - sender of the message
+            src*    - channel by which the message was delivered
+        """
+        sender, src = self.multiparse(parser, ['sender', 'src'])
+
+        _ = self.get_translation(sender)
+
+        page = PAGES.get(sender)
+
+        if not page:
+            return self.feedback(_("Nothing else to show"), sender, src)
+
+        handler, params = page
+        params = dict(params, src=src)
+
+        # Parameters are stored as a dict, which behaves like the parser
+        return getattr(self, handler)(params)
+
+    @Message(tags=["related"])
+    @dispatch(mutation=False)
+    def related(self, parser):
+        """ Show the cards most similar to a given card.
+
+            Cards that changed recently may not be up to date yet, they
+            are updated in the background (see RelatedUpdater).
+
+            cid*    - card id
+            sender* - sender of the message
+            src*    - channel by which the message was delivered
+            limit   - maximum number of cards to show (default 5)
+        """
+        cid, sender, src, limit = self.multiparse(
+            parser, ['cid', 'sender', 'src', 'limit'])
+
+        _ = self.get_translation(sender)
+
+        with LOCK.read():
+            try:
+                with self.connect() as ar:
+                    if not ar.get_card_rows([int(cid)]):
+                        return self.feedback(_("Card %s does not exist") % cid,
+                            sender, src)
+
+                    cards = ar.related_cards(int(cid),
+                        limit=int(limit) if limit else 5)
+
+                    # For instance, cards imported while the agent was not
+                    # running
+                    if ar.related_index.pending():
+                        RELATED.notify()
+
+                        if not cards and ar.related_index.pending(int(cid)):
+                            return self.feedback(_("Related cards are "
+                                "still being computed, try again later"),
+                                sender, src)
+
+            except Exception as e:
+                return self.feedback("Error: " + str(e), sender, src)
+
+        lines = list(self.card_lines(cards))
+
+        if not lines:
+            lines.append(_("No related cards found"))
+
+        return self.split_feedback(lines, sender, src)
+
     @Message(tags=["remove-section"])
+    @dispatch(mutation=True)
     def remove_card_from_section(self, parser):
         """ Remove a card from a given section.
 
@@ -452,17 +1296,19 @@ class Archivist:
         cid, sname, sender, src = self.multiparse(
             parser, ['cid', 'sname', 'sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not self.has_permissions(sender):
             self.logger.info("%s cannot modify section relations" % sender)
             return self.feedback(_("You don't have permissions to do that"),
                 sender, src)
 
-        with LOCK:
+        with LOCK.write():
             try:
-                ar = self.connect()
-                result = ar.remove_card_from_section(cid=int(cid), sname=sname)
+                with self.connect() as ar:
+                    result = ar.remove_card_from_section(
+                        cid=int(cid), sname=sname)
+                    CACHE.relation_changed(int(cid))
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -475,6 +1321,7 @@ class Archivist:
             _("Could not remove card"), sender, src)
 
     @Message(tags=["rename-section"])
+    @dispatch(mutation=True)
     def rename_section(self, parser):
         """ Rename a section of the archive.
 
@@ -486,17 +1333,18 @@ class Archivist:
         name, newname, sender, src = self.multiparse(
             parser, ['name', 'newname', 'sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not self.has_permissions(sender):
             self.logger.info("%s cannot modify section relations" % sender)
             return self.feedback(_("You don't have permissions to do that"),
                 sender, src)
 
-        with LOCK:
+        with LOCK.write():
             try:
-                ar = self.connect()
-                result = ar.rename_section(newname, oldname=name)
+                with self.connect() as ar:
+                    result = ar.rename_section(newname, oldname=name)
+                    CACHE.sections_changed(name)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
@@ -509,121 +1357,327 @@ class Archivist:
             _("Could not rename"), sender, src)
 
     @Message(tags=["search"])
+    @dispatch(mutation=False)
     def search(self, parser):
         """ Traverse a section and find cards relevant to the query.
 
+            Results are cached until the archive is modified.
+
             query*  - search query
             sender* - sender of the message
             section - narrow search results to the specified section
             src     - channel by which the message was delivered
         """
-        query, sender, section, src = self.multiparse(
-            parser, ['query', 'sender', 'section', 'src'])
+        query, sender, section, src, limit, offset = self.multiparse(
+            parser, ['query', 'sender', 'section', 'src', 'limit', 'offset'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
         if not query:
             return self.feedback(_("No query specified"), sender, src)
 
-        result = ""
-
-        with LOCK:
+        with LOCK.read():
             try:
-                ar = self.connect()
-                cards = ar.search(query, sname=section)
+                limit, offset = self.page_args(limit, offset)
 
-                for card in cards:
-                    result += "- [%d] %s: %s\n" % (
-                        card.id, card.title, card.desc)
+                # Searches ignore case, order and repetition of the terms
+                key = (CACHE.generation,
+                    " ".join(sorted(set(query.lower().split()))),
+                    section or "", limit, offset)
+
+                def load():
+                    with self.connect() as ar:
+                        # One more card to know if there is a next page
+                        return list(ar.search(query, sname=section,
+                            limit=limit + 1, offset=offset, rows=True))
+
+                cards = CACHE.searches.load(key, load)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
 
-        if not result:
-            result = _("No cards found")
+        lines = list(self.card_lines(cards[:limit]))
+
+        if not lines:
+            lines.append(_("No cards found"))
 
-        return self.feedback(result, sender, src)
+        lines.append(self.remember_page(_, len(cards) > limit, "search", {
+            "query": query, "sender": sender, "section": section,
+            "limit": limit, "offset": offset + limit}))
+
+        return self.split_feedback(lines, sender, src)
 
     @Message(tags=["section-list"])
+    @dispatch(mutation=False)
     def section_list(self, parser):
-        """ Show all the sections in the archive.
+        """ Show all the sections in the archive, with the number of cards
+            in each one and the latest modification of those cards.
 
             sender* - sender of the message
             src*    - channel by which the message was delivered
         """
         sender, src = self.multiparse(parser, ['sender', 'src'])
 
-        self.set_locale(sender)
+        _ = self.get_translation(sender)
 
-        with LOCK:
+        with LOCK.read():
             try:
-                ar = self.connect()
-                sections = ar.sections()
-
-                msg = ""
-                for section in sections:
-                    msg += "- %s\n" % section.name
+                with self.connect() as ar:
+                    sections = ar.section_summary()
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
 
-        if not msg:
-            msg = _("No sections found")
+        lines = []
 
-        return self.feedback(msg, sender, src)
+        for name, count, modified in sections:
+            if modified:
+                lines.append("- %s (%d) <%s>\n" % (
+                    name, count, str(modified)[:19]))
+
+            else:
+                lines.append("- %s (%d)\n" % (name, count))
+
+        if not lines:
+            lines.append(_("No sections found"))
+
+        return self.split_feedback(lines, sender, src)
 
     @Message(tags=["section-cards"])
+    @dispatch(mutation=False)
     def section_cards(self, parser):
         """ Show all the cards present in a section.
 
             name*   - section name
             sender* - sender of the message
             src*    - channel by which the message was delivered
+            limit   - maximum number of cards to show
+            offset  - number of cards to skip
         """
-        name, sender, src = self.multiparse(
-            parser, ['name', 'sender', 'src'])
+        name, sender, src, limit, offset = self.multiparse(
+            parser, ['name', 'sender', 'src', 'limit', 'offset'])
+
+        _ = self.get_translation(sender)
+
+        with LOCK.read():
+            try:
+                limit, offset = self.page_args(limit, offset)
+
+                with self.connect() as ar:
+                    section = ar.get_section(name=name)
+
+                    if not section:
+                        return self.feedback(
+                            _("Section %s does not exist") % name,
+                            sender, src)
+
+                    # One more card to know if there is a next page
+                    cards = ar.card_rows(section.id, limit=limit + 1,
+                        offset=offset)
 
-        self.set_locale(sender)
+            except Exception as e:
+                return self.feedback("Error: " + str(e), sender, src)
+
+        lines = list(self.card_lines(cards[:limit]))
+
+        if not lines:
+            lines.append(_("No cards found"))
+
+        lines.append(self.remember_page(_, len(cards) > limit,
+            "section_cards", {"name": name, "sender": sender, "limit": limit,
+            "offset": offset + limit}))
+
+        return self.split_feedback(lines, sender, src)
+
+    @Message(tags=["stats"])
+    @dispatch(mutation=False)
+    def stats(self, parser):
+        """ Show usage statistics of the agent.
+
+            sender - sender of the message
+            src    - channel by which the message was delivered
+        """
+        sender, src = self.multiparse(parser, ['sender', 'src'])
+
+        _ = self.get_translation(sender)
+
+        if not self.has_permissions(sender):
+            self.logger.info("%s cannot see statistics" % sender)
+            return self.feedback(_("You don't have permissions to do that"),
+                sender, src)
+
+        lines = []
+
+        for name, cache in CACHE.all():
+            lookups = cache.hits + cache.misses
+            lines.append(
+                "- cache %s: %d/%d entries, %d hits, %d misses, "
+                "%.1f%% hit rate\n" % (name, len(cache), cache.size,
+                cache.hits, cache.misses,
+                100 * cache.hits / lookups if lookups else 0))
+
+        lines.extend(METRICS.report())
+
+        return self.split_feedback(lines, sender, src)
+
+    @Message(tags=["tag-cards"])
+    @dispatch(mutation=False)
+    def tag_cards(self, parser):
+        """ Show the cards that have the given tags.
 
-        msg = ""
+            query*  - tags joined by AND or OR, such as 'python AND asyncio'
+            sender* - sender of the message
+            src*    - channel by which the message was delivered
+            limit   - maximum number of cards to show
+            offset  - number of cards to skip
+        """
+        query, sender, src, limit, offset = self.multiparse(
+            parser, ['query', 'sender', 'src', 'limit', 'offset'])
 
-        with LOCK:
+        _ = self.get_translation(sender)
+
+        with LOCK.read():
             try:
-                ar = self.connect()
-                section = ar.get_section(name=name)
+                limit, offset = self.page_args(limit, offset)
+
+                with self.connect() as ar:
+                    cards, total = ar.tag_cards(query or "", limit=limit,
+                        offset=offset)
+
+            except Exception as e:
+                return self.feedback("Error: " + str(e), sender, src)
+
+        if not total:
+            return self.feedback(_("No cards found"), sender, src)
+
+        lines = [_("Cards found: %d") % total + "\n"]
+        lines.extend(self.card_lines(cards))
+
+        lines.append(self.remember_page(_, offset + limit < total,
+            "tag_cards", {"query": query, "sender": sender, "limit": limit,
+            "offset": offset + limit}))
 
-                if not section:
-                    return self.feedback(
-                        _("Section %s does not exist") % name, sender, src)
+        return self.split_feedback(lines, sender, src)
 
-                cards = section.cards()
-                for card in cards:
-                    msg += "- [%d] %s: %s\n" % (
-                        card.id, card.title, card.desc)
+    @Message(tags=["tag-list"])
+    @dispatch(mutation=False)
+    def tag_list(self, parser):
+        """ Show the tags in the archive and how many cards have each one.
+
+            sender* - sender of the message
+            src*    - channel by which the message was delivered
+            limit   - maximum number of tags to show
+            offset  - number of tags to skip
+        """
+        sender, src, limit, offset = self.multiparse(
+            parser, ['sender', 'src', 'limit', 'offset'])
+
+        _ = self.get_translation(sender)
+
+        with LOCK.read():
+            try:
+                limit, offset = self.page_args(limit, offset)
+
+                with self.connect() as ar:
+                    # One more tag to know if there is a next page
+                    tags = ar.tag_counts(limit=limit + 1, offset=offset)
 
             except Exception as e:
                 return self.feedback("Error: " + str(e), sender, src)
 
-        if not msg:
-            msg = _("No cards found")
+        lines = ["- %s (%d)\n" % tag for tag in tags[:limit]]
+
+        if not lines:
+            lines.append(_("No tags found"))
 
-        return self.feedback(msg, sender, src)
+        lines.append(self.remember_page(_, len(tags) > limit,
+            "tag_list", {"sender": sender, "limit": limit,
+            "offset": offset + limit}))
+
+        return self.split_feedback(lines, sender, src)
 
     def build_card_msg(self, card):
         """ Format the card's information for easier reading. """
-        msg = "\n--------------------\n"
-        msg += "[%d] %s" % (card.id, card.title)
-        msg += "\n--------------------\n\n"
-        msg += "%s\n\n" % card.desc
-        msg += "Last modified <%s> - %s\n" % (
-            str(card.modified), card.modified_by)
-        msg += "Tags: %s\n\n" % card.tags
-        msg += card.content
+        return (
+            "\n--------------------\n"
+            "[%d] %s"
+            "\n--------------------\n\n"
+            "%s\n\n"
+            "Last modified <%s> - %s\n"
+            "Tags: %s\n\n"
+            "%s") % (
+                card.id, card.title, card.desc, str(card.modified),
+                card.modified_by, card.tags, card.content)
+
+    def card_fields(self, parser):
+        """ Obtain the title, description, content and tags of a card.
+
+            The mail processor stores them as a JSON object in a file
+            whose path is given as 'file', so that fields may contain any
+            character and big contents are not copied in the message.
+            Otherwise they are obtained from the message itself, where
+            newlines in the content are escaped as '_NL_'.
+
+            The file is not removed here, see handoff().
+
+            Returns a list with the fields, missing ones are empty.
+        """
+        file_path = parser.get('file')
 
-        return msg
+        if not file_path:
+            fields = self.multiparse(parser,
+                ['title', 'desc', 'content', 'tags'])
+            fields[2] = (fields[2] or "").replace('_NL_', '\n')
 
+            return fields
+
+        with open(file_path, "r") as f:
+            card = load_card(f)
+
+        return [card['title'], card['desc'], card['content'], card['tags']]
+
+    def card_lines(self, cards):
+        """ Generate one summary line for each card. """
+        for card in cards:
+            yield "- [%d] %s: %s\n" % (card.id, card.title, card.desc)
+
+    def card_msgs(self, cards):
+        """ Generate the full information of each card. """
+        for card in cards:
+            yield self.build_card_msg(card) + "\n\n"
+
+    @contextmanager
     def connect(self):
-        return Archive(db_type='sqlite', db_name=DB_PATH)
+        """ Check out a connection to the archive from the pool.
+
+            The time spent with the connection is measured as database
+            time of the handler.
+        """
+        with METRICS.timer("db"), POOL.connection() as ar:
+            yield ar
+
+    def export_path(self, name):
+        """ Obtain the path where an exported file is written.
+
+            Files are always written inside EXPORT_DIR, which is created
+            if needed, so that exports cannot replace any other file the
+            agent can write (such as the archive itself). Absolute paths
+            and names that leave the directory are rejected.
+        """
+        parts = name.replace("\\", "/").split("/")
+
+        if not name or isabs(name) or ".." in parts:
+            raise ValueError("invalid export file name '%s'" % name)
+
+        root = realpath(EXPORT_DIR)
+        file_path = realpath(path(root, name))
+
+        if not file_path.startswith(root + sep):
+            raise ValueError("invalid export file name '%s'" % name)
+
+        makedirs(root, exist_ok=True)
+
+        return file_path
 
     def feedback(self, msg, user, dst=None, subject=None, att=None):
         """ Send a message or mail to a given user.
@@ -637,6 +1691,8 @@ class Archivist:
         if not user:
             return
 
+        METRICS.add("reply", len(msg or ""))
+
         to_send = {
             "dst": "relay",
             "to": user
@@ -655,16 +1711,198 @@ class Archivist:
 
         return zoe.MessageBuilder(to_send)
 
+    def get_translation(self, user):
+        """ Obtain the translation function for the locale of the user.
+
+            If no locale is povided, Zoe's default locale is used or
+            English (en) is used by default.
+
+            The function is returned instead of being installed globally
+            so that concurrent handlers do not affect each other.
+        """
+        if not user:
+            locale = ZOE_LOCALE
+
+        else:
+            locale = USERS.locale(user, ZOE_LOCALE)
+
+        return CATALOGS.get(locale).gettext
+
+    @contextmanager
+    def handoff(self, file_path, remove):
+        """ Remove a file handed over by another agent (such as mailproc)
+            when leaving the block, if 'remove' is 'yes'.
+
+            The file is removed however the handler ends, including when
+            the sender has no permissions to use it. Only files created
+            by the mail processor are removed (see is_handoff()), so that
+            a message cannot remove any other file the agent can write.
+        """
+        try:
+            yield
+
+        finally:
+            if remove == "yes" and self.is_handoff(file_path):
+                with suppress(OSError):
+                    unlink(file_path)
+
+    def is_handoff(self, file_path):
+        """ Check if a file was created by the mail processor, which
+            writes them directly in the temporary directory with names
+            starting with 'archivist-'.
+        """
+        if not file_path:
+            return False
+
+        directory, name = split(abspath(file_path))
+
+        return (name.startswith("archivist-")
+            and realpath(directory) == realpath(tempfile.gettempdir()))
+
     def has_permissions(self, user):
         """ Check if the user has permissions necessary to interact with the
             agent manager (belongs to group 'archivists').
         """
         # No user, manual commands from terminal
-        if not user or user in Users().membersof("archivists"):
+        if not user or USERS.is_member(user):
             return True
 
         return False
 
+    def mail_cards(self, _, entries):
+        """ Build the body and attachment of a mail with cards.
+
+            Cards are formatted for the body as they are read. Once their
+            text is longer than ATTACHMENT_SIZE, they are attached instead
+            (see ATTACHMENT_FORMAT) and the rest are written directly to
+            the attachment, so the cards are read once and only the ones
+            read before that point are formatted again in Markdown for zip
+            attachments. Notices always stay in the body.
+
+            _       - translation function of the recipient
+            entries - cards, as generated by export_cards(), and notices
+                      (strings) to show among them, in order
+
+            Returns a tuple with the body of the mail and the attachment,
+            which is None if the cards are in the body.
+        """
+        def text_of(entry):
+            if isinstance(entry, str):
+                return entry
+
+            return self.build_card_msg(SimpleNamespace(**entry)) + "\n\n"
+
+        entries = iter(entries)
+        read = []
+        size = 0
+
+        for entry in entries:
+            text = text_of(entry)
+            read.append((entry, text))
+            size += len(text)
+
+            if ATTACHMENT_SIZE and size > ATTACHMENT_SIZE:
+                break
+
+        else:
+            return "".join(text for entry, text in read), None
+
+        notices = [_("The cards are attached") + "\n\n"]
+
+        with tempfile.TemporaryFile(prefix="archivist-") as f:
+            if ATTACHMENT_FORMAT == "txt":
+                bundle = None
+                mimetype, filename = "text/plain", "archivist.txt"
+
+            else:
+                bundle = zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED)
+                mimetype, filename = "application/zip", "archivist.zip"
+
+            for entry, text in chain(read, ((e, None) for e in entries)):
+                if isinstance(entry, str):
+                    notices.append(entry)
+
+                elif bundle:
+                    bundle.writestr("%d.md" % entry["id"],
+                        format_markdown(entry))
+
+                else:
+                    f.write((text or text_of(entry)).encode("utf-8"))
+
+            if bundle:
+                bundle.close()
+
+            f.seek(0)
+
+            return "".join(notices), zoe.Attachment(f.read(), mimetype,
+                filename)
+
+    def page_args(self, limit, offset):
+        """ Parse the pagination arguments of a listing.
+
+            The page size from the configuration is used when no valid
+            limit is given.
+        """
+        limit = int(limit) if limit else 0
+        offset = int(offset) if offset else 0
+
+        return limit if limit > 0 else PAGE_SIZE, max(offset, 0)
+
+    def remember_page(self, _, more, handler, params):
+        """ Store the arguments needed to obtain the next page of a
+            listing, so that it can be requested with 'next-page'.
+
+            Returns a notice to append to the listing if there are more
+            results to show.
+        """
+        sender = params.get("sender")
+
+        if not more:
+            PAGES.pop(sender, None)
+            return ""
+
+        PAGES[sender] = (handler, params)
+
+        return "\n" + _("There are more results, ask for the next page")
+
+    def split_feedback(self, chunks, user, dst=None):
+        """ Send chunks of text as one or more messages to a user.
+
+            Chunks are joined in order, starting a new message whenever
+            the next one would exceed the maximum message size. Chunks
+            that are larger than the maximum size are cut.
+
+            Returns a tuple of messages.
+        """
+        if not user:
+            return
+
+        messages = []
+        parts = []
+        size = 0
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+
+            if parts and size + len(chunk) > MAX_MSG_SIZE:
+                messages.append(self.feedback("".join(parts), user, dst))
+                parts = []
+                size = 0
+
+            while len(chunk) > MAX_MSG_SIZE:
+                messages.append(
+                    self.feedback(chunk[:MAX_MSG_SIZE], user, dst))
+                chunk = chunk[MAX_MSG_SIZE:]
+
+            parts.append(chunk)
+            size += len(chunk)
+
+        if parts or not messages:
+            messages.append(self.feedback("".join(parts), user, dst))
+
+        return tuple(messages)
+
     def multiparse(self, parser, keys):
         """ Obtain several elements from the parser, identified by the
             list of keys.
@@ -676,21 +1914,3 @@ class Archivist:
             result.append(parser.get(k))
 
         return result
-
-    def set_locale(self, user):
-        """ Set the locale for messages based on the locale of the sender.
-
-            If no locale is povided, Zoe's default locale is used or
-            English (en) is used by default.
-        """
-        if not user:
-            locale = ZOE_LOCALE
-
-        else:
-            conf = Users().subject(user)
-            locale = conf.get("locale", ZOE_LOCALE)
-
-        lang = gettext.translation("archivist", localedir=LOCALEDIR,
-            languages=[locale,])
-
-        lang.install()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" In-memory caches of the information read from the archive. """
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Thread-safe cache that discards the least recently used entries.
+
+        Keeps count of hits and misses. A size of 0 disables the cache.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """ Remove every entry. """
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, key, loader):
+        """ Obtain the value for the key, calling 'loader' on a miss.
+
+            None values are not stored.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            self.misses += 1
+
+        value = loader()
+
+        if value is not None:
+            self.put(key, value)
+
+        return value
+
+    def pop(self, key):
+        """ Remove the entry for the key, if present. """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def put(self, key, value):
+        """ Store a value, discarding the oldest entry if needed. """
+        if not self.size:
+            return
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class ArchiveCache:
+    """ Caches for the information that is read most often.
+
+        cards         -- card id to card
+        sections      -- section name to section
+        card_sections -- card id to names of the sections it appears in
+        section_list  -- summary (name, cards, latest modification) of
+                         every section
+        searches      -- search query to the cards found
+
+        Entries are not refreshed automatically: mutating handlers must
+        invalidate whatever they modify while they still hold the archive
+        lock for writing. Search results are instead keyed by the
+        generation of the archive, which every invalidation changes (see
+        archive_changed).
+    """
+
+    def __init__(self, size):
+        self.cards = LRUCache(size)
+        self.sections = LRUCache(size)
+        self.card_sections = LRUCache(size)
+        self.section_list = LRUCache(1 if size else 0)
+        self.searches = LRUCache(size)
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def all(self):
+        """ Obtain a list of (name, cache) pairs. """
+        return [
+            ("cards", self.cards),
+            ("sections", self.sections),
+            ("card_sections", self.card_sections),
+            ("section_list", self.section_list),
+            ("searches", self.searches),
+        ]
+
+    def archive_changed(self):
+        """ Start a new generation of the archive.
+
+            Search results cached before are no longer used.
+        """
+        with self._lock:
+            self.generation += 1
+
+        self.searches.clear()
+
+    def card_changed(self, cid):
+        """ Invalidate the information of a card. """
+        self.archive_changed()
+        self.cards.pop(cid)
+        # Modification dates of its sections may have changed
+        self.section_list.clear()
+
+    def card_deleted(self, cid):
+        """ Invalidate a removed card. """
+        self.archive_changed()
+        self.cards.pop(cid)
+        self.card_sections.pop(cid)
+        self.section_list.clear()
+
+    def relation_changed(self, cid):
+        """ Invalidate the sections of a card. """
+        self.archive_changed()
+        self.card_sections.pop(cid)
+        self.section_list.clear()
+
+    def sections_changed(self, name=None):
+        """ Invalidate the list of sections and the given section. """
+        self.archive_changed()
+
+        if name:
+            self.sections.pop(name)
+            # Section names of every card may have changed
+            self.card_sections.clear()
+
+        self.section_list.clear()
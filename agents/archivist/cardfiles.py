@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Files with cards, used to import and export them in bulk and to
+    receive cards from the mail processor without escaping their fields.
+
+    Every card is read as a dictionary with the keys 'title', 'desc',
+    'content' and 'tags', which are strings, and 'sections', a list of
+    section names.
+
+    Can also be run to export an archive without the agent:
+
+        python3 cardfiles.py ARCHIVE OUTPUT [--format F] [--section S]
+                                            [--tag T]
+"""
+
+import argparse
+import csv
+import json
+import sqlite3
+from indexes import LOWER, MAX_IN_PARAMS
+from os import replace
+from os.path import splitext
+
+FIELDS = ('title', 'desc', 'content', 'tags', 'sections')
+
+# Separator of section names in the export query
+SEP = '\x1f'
+
+# Tags of a card in lowercase, separated by single spaces at both ends
+TAGS_SQL = (
+    '\' \' || lower(replace(replace(replace("c"."tags", char(9), \' \'), '
+    'char(10), \' \'), char(13), \' \')) || \' \'')
+
+EXPORT_SQL = (
+    'SELECT "c"."id", "c"."title", "c"."desc", "c"."content", "c"."tags", '
+    '"c"."modified", "c"."modified_by", '
+    '(SELECT group_concat("s"."name", char(31)) FROM "relation" AS "r" '
+    'JOIN "section" AS "s" ON "s"."id" = "r"."section_id" '
+    'WHERE "r"."card_id" = "c"."id") '
+    'FROM "card" AS "c"')
+
+
+def export_cards(execute, section='', tag='', cids=None):
+    """ Obtain the cards in the archive with the names of their sections,
+        ordered by id.
+
+        execute -- function that runs a SQL query with parameters and
+                   returns a cursor, such as the 'execute_sql' method of
+                   the database
+        section -- only export the cards in the section with this name
+        tag     -- only export the cards with this tag (in any case)
+        cids    -- only export the cards with these ids, which are
+                   queried MAX_IN_PARAMS at a time
+
+        Rows are read from the cursor one at a time, so memory use does
+        not depend on the size of the archive.
+
+        Returns a generator of card dictionaries that also include the
+        keys 'id', 'modified' and 'modified_by'.
+    """
+    sql = EXPORT_SQL
+    conditions = []
+    params = []
+
+    if section:
+        conditions.append(
+            '"c"."id" IN (SELECT "r"."card_id" FROM "relation" AS "r" '
+            'JOIN "section" AS "s" ON "s"."id" = "r"."section_id" '
+            'WHERE "s"."name" = ?)')
+        params.append(section)
+
+    if tag:
+        conditions.append('instr(' + TAGS_SQL + ', ?) > 0')
+        params.append(' %s ' % tag.translate(LOWER))
+
+    # Chunks are queried in order, so cards are still ordered by id
+    chunks = [None]
+
+    if cids is not None:
+        cids = sorted(set(cids))
+        chunks = [cids[i:i + MAX_IN_PARAMS]
+            for i in range(0, len(cids), MAX_IN_PARAMS)]
+
+    for chunk in chunks:
+        where = list(conditions)
+
+        if chunk is not None:
+            where.append('"c"."id" IN (%s)' % ', '.join('?' * len(chunk)))
+
+        query = sql
+
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+
+        cursor = execute(query + ' ORDER BY "c"."id"',
+            params + (chunk or []))
+
+        for row in cursor:
+            yield {
+                'id': row[0],
+                'title': row[1],
+                'desc': row[2],
+                'content': row[3],
+                'tags': row[4],
+                'sections': row[7].split(SEP) if row[7] else [],
+                'modified': str(row[5]),
+                'modified_by': row[6],
+            }
+
+
+def format_markdown(card):
+    """ Format a card (as returned by export_cards()) in Markdown. """
+    return (
+        '# [%d] %s\n\n'
+        '%s\n\n'
+        '- Sections: %s\n'
+        '- Tags: %s\n'
+        '- Last modified: %s - %s\n\n'
+        '%s\n\n' % (
+            card['id'], card['title'], card['desc'],
+            ', '.join(card['sections']), card['tags'],
+            card['modified'], card['modified_by'],
+            card['content']))
+
+
+def guess_format(file_path):
+    """ Guess the format of a file of cards from its extension.
+
+        JSON lines is used by default.
+    """
+    ext = splitext(file_path)[1].lower()
+
+    if ext == '.csv':
+        return 'csv'
+
+    if ext == '.md':
+        return 'md'
+
+    return 'jsonl'
+
+
+def load_card(f):
+    """ Read a single card stored as a JSON object in an open file.
+
+        Returns a card dictionary.
+    """
+    row = json.load(f)
+
+    if not isinstance(row, dict):
+        raise ValueError("expected an object")
+
+    return normalize(row)
+
+
+def normalize(row):
+    """ Obtain a card dictionary from the fields read from a file.
+
+        Missing fields are empty and lists of tags are joined with
+        spaces. Sections may be given as a list or as a string of names
+        separated by whitespace.
+    """
+    card = {}
+
+    for field in FIELDS:
+        value = row.get(field)
+
+        if value is None:
+            value = ''
+
+        if field == 'sections':
+            if isinstance(value, str):
+                value = value.split()
+
+            card[field] = [str(v) for v in value]
+            continue
+
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(str(v) for v in value)
+
+        card[field] = str(value)
+
+    return card
+
+
+def read_cards(f, fmt):
+    """ Read the cards in an open file, one at a time.
+
+        f   -- file object opened in text mode
+        fmt -- 'csv' (with a header line naming the fields) or 'jsonl'
+               (one JSON object per line, blank lines are ignored)
+
+        Returns a generator of card dictionaries.
+    """
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            yield normalize(row)
+
+        return
+
+    if fmt != 'jsonl':
+        raise ValueError("cannot import format '%s'" % fmt)
+
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+
+        except ValueError as e:
+            raise ValueError("line %d: %s" % (number, e))
+
+        if not isinstance(row, dict):
+            raise ValueError("line %d: expected an object" % number)
+
+        yield normalize(row)
+
+
+def write_cards(file_path, cards, fmt):
+    """ Write cards to a file, one at a time.
+
+        The file is written with a temporary name and renamed once
+        complete, so an existing file is only replaced by a full export.
+
+        file_path -- path of the file to write
+        cards     -- iterable of cards, as returned by export_cards()
+        fmt       -- 'jsonl' (can be imported again) or 'md' (Markdown)
+
+        Returns the number of cards written.
+    """
+    if fmt not in ('jsonl', 'md'):
+        raise ValueError("cannot export format '%s'" % fmt)
+
+    count = 0
+    partial = file_path + '.part'
+
+    with open(partial, 'w') as f:
+        for card in cards:
+            if fmt == 'jsonl':
+                f.write(json.dumps(card) + '\n')
+
+            else:
+                f.write(format_markdown(card))
+
+            count += 1
+
+    replace(partial, file_path)
+
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export an archive.')
+    parser.add_argument('archive', help='path to the SQLite database')
+    parser.add_argument('output', help='path of the file to write')
+    parser.add_argument('--format', choices=('jsonl', 'md'))
+    parser.add_argument('--section', default='')
+    parser.add_argument('--tag', default='')
+
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.archive)
+
+    try:
+        count = write_cards(
+            args.output,
+            export_cards(conn.execute, args.section, args.tag),
+            args.format or guess_format(args.output))
+
+    finally:
+        conn.close()
+
+    print("Exported %d cards to %s" % (count, args.output))
@@ -0,0 +1,847 @@
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Indexes stored alongside the archive tables.
+
+    They live in the same SQLite database as the cards and are kept up to
+    date by triggers on the tables created by infocards, so they remain
+    consistent no matter how the archive is modified.
+"""
+
+import heapq
+import math
+import string
+import threading
+from collections import defaultdict
+
+from peewee import OperationalError
+
+# Maximum number of parameters in a single 'IN (...)' clause
+MAX_IN_PARAMS = 500
+
+# Same conversion as the lower() function of SQLite
+LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Errors of SQLite libraries built without the FTS5 or JSON extensions
+_UNSUPPORTED = ("no such module: fts5", "no such table: json_each",
+    "no such function: json_")
+
+
+def _unsupported(error):
+    """ Check if an error is caused by a missing SQLite extension.
+
+        Any other error, such as a locked database, may go away if the
+        operation is tried again.
+    """
+    return str(error).startswith(_UNSUPPORTED)
+
+
+class SearchIndex:
+    """ Full-text index over the title, description and tags of cards.
+
+        Uses an FTS5 table with the 'card' table as external content. If
+        the SQLite library was built without FTS5, 'available' is False
+        and the index must not be used.
+    """
+
+    SETUP = (
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "card_fts" USING fts5('
+        '"title", "desc", "tags", content="card", content_rowid="id")',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_fts_ai" AFTER INSERT ON "card" '
+        'BEGIN '
+        'INSERT INTO "card_fts" ("rowid", "title", "desc", "tags") '
+        'VALUES (new."id", new."title", new."desc", new."tags"); '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_fts_ad" AFTER DELETE ON "card" '
+        'BEGIN '
+        'INSERT INTO "card_fts" '
+        '("card_fts", "rowid", "title", "desc", "tags") '
+        'VALUES (\'delete\', old."id", old."title", old."desc", old."tags"); '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_fts_au" '
+        'AFTER UPDATE OF "title", "desc", "tags" ON "card" '
+        'BEGIN '
+        'INSERT INTO "card_fts" '
+        '("card_fts", "rowid", "title", "desc", "tags") '
+        'VALUES (\'delete\', old."id", old."title", old."desc", old."tags"); '
+        'INSERT INTO "card_fts" ("rowid", "title", "desc", "tags") '
+        'VALUES (new."id", new."title", new."desc", new."tags"); '
+        'END',
+    )
+
+    # Weights of title, description and tags when ranking results
+    RANK = 'bm25("card_fts", 10.0, 2.0, 5.0)'
+
+    def __init__(self, db):
+        self._db = db
+        self.available = False
+
+    def setup(self):
+        """ Create the index if needed and fill it with existing cards. """
+        try:
+            exists = self._db.execute_sql(
+                'SELECT 1 FROM "sqlite_master" WHERE "name" = ?',
+                ("card_fts",)).fetchone()
+
+            for statement in self.SETUP:
+                self._db.execute_sql(statement)
+
+            if not exists:
+                self.rebuild()
+
+        except OperationalError as e:
+            if not _unsupported(e):
+                raise
+
+            # No FTS5 support
+            self.available = False
+            return
+
+        self.available = True
+
+    def rebuild(self):
+        """ Rebuild the whole index from the card table. """
+        self._db.execute_sql(
+            'INSERT INTO "card_fts" ("card_fts") VALUES (\'rebuild\')')
+
+    def search(self, query, sid=0, limit=0, offset=0):
+        """ Find cards that contain any of the terms in the query.
+
+            Terms are matched as prefixes. Results are ranked by relevance,
+            giving more weight to matches in the title and tags.
+
+            query  -- search terms, separated by blankspace
+            sid    -- optional section id to narrow the search
+            limit  -- maximum number of results (0 for all)
+            offset -- number of results to skip
+
+            Returns the list of matching card ids.
+        """
+        match = self.match_expression(query)
+        if not match:
+            return []
+
+        sql = 'SELECT "rowid" FROM "card_fts" WHERE "card_fts" MATCH ?'
+        params = [match]
+
+        if sid:
+            sql += (' AND "rowid" IN (SELECT "card_id" FROM "relation" '
+                'WHERE "section_id" = ?)')
+            params.append(sid)
+
+        sql += ' ORDER BY ' + self.RANK
+
+        if limit:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend((limit, offset))
+
+        return [row[0] for row in self._db.execute_sql(sql, params)]
+
+    @staticmethod
+    def match_expression(query):
+        """ Build an FTS5 query from plain search terms.
+
+            Every term is quoted so that FTS5 operators in the query are
+            treated as text.
+        """
+        terms = set(t.lower() for t in query.split())
+
+        return " OR ".join(
+            '"%s"*' % t.replace('"', '""') for t in sorted(terms))
+
+
+class SectionSummary:
+    """ Number of cards in every section and the most recent modification
+        date among them.
+
+        Stored in the 'section_summary' table, which is kept up to date by
+        triggers on the 'section', 'relation' and 'card' tables, so the
+        summary of every section is read without loading any card.
+    """
+
+    # Latest modification date of the cards in a section
+    LATEST = (
+        '(SELECT max("c"."modified") FROM "relation" AS "r" '
+        'JOIN "card" AS "c" ON "c"."id" = "r"."card_id" '
+        'WHERE "r"."section_id" = {sid})')
+
+    SETUP = (
+        'CREATE TABLE IF NOT EXISTS "section_summary" ('
+        '"section_id" INTEGER PRIMARY KEY, '
+        '"cards" INTEGER NOT NULL DEFAULT 0, "modified" DATETIME)',
+
+        'CREATE TRIGGER IF NOT EXISTS "section_summary_si" '
+        'AFTER INSERT ON "section" '
+        'BEGIN '
+        'INSERT OR IGNORE INTO "section_summary" ("section_id") '
+        'VALUES (new."id"); '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "section_summary_sd" '
+        'AFTER DELETE ON "section" '
+        'BEGIN '
+        'DELETE FROM "section_summary" WHERE "section_id" = old."id"; '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "section_summary_ri" '
+        'AFTER INSERT ON "relation" '
+        'BEGIN '
+        'UPDATE "section_summary" SET "cards" = "cards" + 1, '
+        '"modified" = max(coalesce("modified", \'\'), '
+        '(SELECT "modified" FROM "card" WHERE "id" = new."card_id")) '
+        'WHERE "section_id" = new."section_id"; '
+        'END',
+
+        # The latest date is only searched again if the removed card had it
+        'CREATE TRIGGER IF NOT EXISTS "section_summary_rd" '
+        'AFTER DELETE ON "relation" '
+        'BEGIN '
+        'UPDATE "section_summary" SET "cards" = "cards" - 1, '
+        '"modified" = CASE WHEN "modified" = '
+        '(SELECT "modified" FROM "card" WHERE "id" = old."card_id") '
+        'THEN ' + LATEST.format(sid='old."section_id"') +
+        ' ELSE "modified" END '
+        'WHERE "section_id" = old."section_id"; '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "section_summary_cu" '
+        'AFTER UPDATE OF "modified" ON "card" '
+        'BEGIN '
+        'UPDATE "section_summary" SET "modified" = new."modified" '
+        'WHERE "section_id" IN (SELECT "section_id" FROM "relation" '
+        'WHERE "card_id" = new."id"); '
+        'END',
+    )
+
+    def __init__(self, db):
+        self._db = db
+
+    def setup(self):
+        """ Create the summary if needed and fill it. """
+        exists = self._db.execute_sql(
+            'SELECT 1 FROM "sqlite_master" WHERE "name" = ?',
+            ("section_summary",)).fetchone()
+
+        for statement in self.SETUP:
+            self._db.execute_sql(statement)
+
+        if not exists:
+            self.rebuild()
+
+    def rebuild(self):
+        """ Compute the summary of every section from scratch. """
+        self._db.execute_sql('DELETE FROM "section_summary"')
+        self._db.execute_sql(
+            'INSERT INTO "section_summary" '
+            '("section_id", "cards", "modified") '
+            'SELECT "s"."id", count("c"."id"), max("c"."modified") '
+            'FROM "section" AS "s" '
+            'LEFT JOIN "relation" AS "r" ON "r"."section_id" = "s"."id" '
+            'LEFT JOIN "card" AS "c" ON "c"."id" = "r"."card_id" '
+            'GROUP BY "s"."id"')
+
+    def sections(self):
+        """ Obtain the summary of every section, ordered by id.
+
+            Returns a list of (name, number of cards, latest modification)
+            tuples. The date is None for empty sections.
+        """
+        return [tuple(row) for row in self._db.execute_sql(
+            'SELECT "s"."name", "ss"."cards", "ss"."modified" '
+            'FROM "section" AS "s" JOIN "section_summary" AS "ss" '
+            'ON "ss"."section_id" = "s"."id" ORDER BY "s"."id"')]
+
+
+# Expression that converts the space separated tags of a card to a JSON
+# array. Malformed arrays are replaced with an empty one.
+_TAGS_JSON = (
+    '\'["\' || replace(replace(replace(replace(replace(replace({tags}, '
+    '\'\\\', \'\\\\\'), \'"\', \'\\"\'), char(9), \' \'), char(10), \' \'), '
+    'char(13), \' \'), \' \', \'","\') || \'"]\'')
+
+_SPLIT_TAGS = (
+    'json_each(CASE WHEN json_valid({json}) THEN {json} ELSE \'[]\' END)')
+
+
+def _split_tags(tags):
+    return _SPLIT_TAGS.format(json=_TAGS_JSON.format(tags=tags))
+
+
+class TagIndex:
+    """ Index that maps every tag to the cards that have it.
+
+        Tags are stored in lowercase in the 'card_tag' table, which is
+        kept up to date by triggers on the 'card' table. If the SQLite
+        library has no JSON support (needed to split the tags),
+        'available' is False and the index must not be used.
+    """
+
+    SETUP = (
+        'CREATE TABLE IF NOT EXISTS "card_tag" ('
+        '"tag" TEXT NOT NULL, "card_id" INTEGER NOT NULL, '
+        'PRIMARY KEY ("tag", "card_id")) WITHOUT ROWID',
+
+        'CREATE INDEX IF NOT EXISTS "card_tag_card_id" '
+        'ON "card_tag" ("card_id")',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_tag_ai" AFTER INSERT ON "card" '
+        'BEGIN '
+        'INSERT OR IGNORE INTO "card_tag" ("tag", "card_id") '
+        'SELECT lower("value"), new."id" FROM ' + _split_tags('new."tags"') +
+        ' WHERE "value" != \'\'; '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_tag_ad" AFTER DELETE ON "card" '
+        'BEGIN '
+        'DELETE FROM "card_tag" WHERE "card_id" = old."id"; '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_tag_au" '
+        'AFTER UPDATE OF "tags" ON "card" '
+        'BEGIN '
+        'DELETE FROM "card_tag" WHERE "card_id" = old."id"; '
+        'INSERT OR IGNORE INTO "card_tag" ("tag", "card_id") '
+        'SELECT lower("value"), new."id" FROM ' + _split_tags('new."tags"') +
+        ' WHERE "value" != \'\'; '
+        'END',
+    )
+
+    def __init__(self, db):
+        self._db = db
+        self.available = False
+
+    def setup(self):
+        """ Create the index if needed and fill it with existing cards. """
+        try:
+            # Check JSON support before creating triggers that need it
+            self._db.execute_sql('SELECT 1 FROM json_each(\'[]\')')
+
+            exists = self._db.execute_sql(
+                'SELECT 1 FROM "sqlite_master" WHERE "name" = ?',
+                ("card_tag",)).fetchone()
+
+            for statement in self.SETUP:
+                self._db.execute_sql(statement)
+
+            if not exists:
+                self.rebuild()
+
+        except OperationalError as e:
+            if not _unsupported(e):
+                raise
+
+            self.available = False
+            return
+
+        self.available = True
+
+    def rebuild(self):
+        """ Rebuild the whole index from the card table. """
+        self._db.execute_sql('DELETE FROM "card_tag"')
+        self._db.execute_sql(
+            'INSERT OR IGNORE INTO "card_tag" ("tag", "card_id") '
+            'SELECT lower("j"."value"), "c"."id" FROM "card" AS "c", ' +
+            _split_tags('"c"."tags"') + ' AS "j" WHERE "j"."value" != \'\'')
+
+    def cards(self, query, limit=0, offset=0):
+        """ Find the cards that match a tag query (see parse_query).
+
+            limit  -- maximum number of results (0 for all)
+            offset -- number of results to skip
+
+            Returns a tuple with the list of matching card ids, ordered
+            by id, and the total number of matching cards.
+        """
+        sql, params = self._query_sql(query)
+
+        if not sql:
+            return [], 0
+
+        total = self._db.execute_sql(
+            'SELECT count(*) FROM (%s)' % sql, params).fetchone()[0]
+
+        sql += ' ORDER BY "card_id"'
+
+        if limit:
+            sql += ' LIMIT ? OFFSET ?'
+            params = params + [limit, offset]
+
+        return [row[0] for row in self._db.execute_sql(sql, params)], total
+
+    def tags(self, limit=0, offset=0):
+        """ Obtain the tags in the archive, ordered by name.
+
+            limit  -- maximum number of results (0 for all)
+            offset -- number of results to skip
+
+            Returns a list of (tag, number of cards) tuples.
+        """
+        sql = ('SELECT "tag", count(*) FROM "card_tag" '
+            'GROUP BY "tag" ORDER BY "tag"')
+        params = []
+
+        if limit:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend((limit, offset))
+
+        return [tuple(row) for row in self._db.execute_sql(sql, params)]
+
+    def _query_sql(self, query):
+        """ Build the SQL query that obtains the ids of matching cards.
+
+            Every group of tags joined by AND is obtained with a single
+            lookup in the index, and the groups are joined with UNION.
+        """
+        selects = []
+        params = []
+
+        for group in self.parse_query(query):
+            selects.append(
+                'SELECT "card_id" FROM "card_tag" WHERE "tag" IN (%s) '
+                'GROUP BY "card_id" HAVING count(*) = %d' % (
+                    ', '.join('?' * len(group)), len(group)))
+            params.extend(group)
+
+        return ' UNION '.join(selects), params
+
+    @classmethod
+    def parse_query(cls, query):
+        """ Parse a tag query.
+
+            Tags are separated by 'AND' or 'OR' (in any case), AND taking
+            precedence. Tags that are only separated by whitespace must
+            all be present, as with AND. For instance, 'python AND asyncio
+            OR rust' finds cards with both 'python' and 'asyncio' and
+            cards with 'rust'.
+
+            Returns a list of groups of tags (OR of ANDs), each group a
+            sorted list of distinct tags in lowercase.
+        """
+        groups = [set()]
+
+        for word in query.split():
+            upper = word.upper()
+
+            if upper == "OR":
+                groups.append(set())
+
+            elif upper != "AND":
+                groups[-1].add(word.translate(LOWER))
+
+        return [sorted(group) for group in groups if group]
+
+
+# Characters that separate the words of a card, besides spaces. Each
+# one is removed with a nested replace(), so the list is kept short
+_SEPARATORS = '\t\n\r"\\\'.,;:!?()[]/-'
+
+
+def _split_words(text):
+    """ SQL expression that splits a text in lowercase words. """
+    for char in _SEPARATORS:
+        text = 'replace(%s, char(%d), \' \')' % (text, ord(char))
+
+    # Quotes and backslashes have been removed, so no escaping is needed
+    return _SPLIT_TAGS.format(
+        json='\'["\' || replace(lower(%s), \' \', \'","\') || \'"]\'' % text)
+
+
+# Columns of a card split in words, title and tags twice to give them more
+# weight, and the value of the 'in_content' column of their words
+_WORD_SOURCES = (
+    (("title", "title", "tags", "tags", "desc"), 0),
+    (("content",), 1),
+)
+
+
+def _card_text(card, columns):
+    """ SQL expression with the given columns of a card. """
+    return ' || \' \' || '.join(
+        'coalesce(%s."%s", \'\')' % (card, column) for column in columns)
+
+
+def _count_words(columns, in_content):
+    """ SQL statement that counts the words in some columns of a new card.
+    """
+    return (
+        'INSERT INTO "card_term" ("term", "card_id", "in_content", "count") '
+        'SELECT "value", new."id", %d, count(*) FROM ' % in_content +
+        _split_words(_card_text('new', columns)) +
+        ' WHERE length("value") > 2 GROUP BY "value"; ')
+
+
+def _other_words(card, in_content):
+    """ SQL condition that excludes the words of a card that are also in
+        its other columns (content or the rest), which must not change
+        the number of cards with the word.
+    """
+    return (
+        '"card_id" = %s."id" AND "in_content" = %d AND NOT EXISTS ('
+        'SELECT 1 FROM "card_term" WHERE "term" = "t"."term" AND '
+        '"card_id" = %s."id" AND "in_content" = %d)' % (
+            card, in_content, card, 1 - in_content))
+
+
+def _update_words(columns, in_content):
+    """ SQL statements that count again the words in some columns of a
+        modified card.
+    """
+    return (
+        'UPDATE "term_stat" SET "cards" = "cards" - 1 WHERE "term" IN '
+        '(SELECT "term" FROM "card_term" AS "t" WHERE ' +
+        _other_words('old', in_content) + '); '
+        'DELETE FROM "card_term" WHERE "card_id" = old."id" '
+        'AND "in_content" = %d; ' % in_content +
+        _count_words(columns, in_content) +
+        'INSERT OR IGNORE INTO "term_stat" ("term", "cards") '
+        'SELECT "term", 0 FROM "card_term" WHERE "card_id" = new."id" '
+        'AND "in_content" = %d; ' % in_content +
+        'UPDATE "term_stat" SET "cards" = "cards" + 1 WHERE "term" IN '
+        '(SELECT "term" FROM "card_term" AS "t" WHERE ' +
+        _other_words('new', in_content) + '); '
+        'INSERT OR REPLACE INTO "card_vector" ("card_id", "norm") '
+        'VALUES (new."id", NULL); ')
+
+
+class RelatedIndex:
+    """ Similar cards of every card, by TF-IDF of the words in them.
+
+        Words (of at least 3 characters) of every card are counted in the
+        'card_term' table and the number of cards with each word in
+        'term_stat', both kept up to date by triggers on the 'card'
+        table. Those triggers also mark the card as pending in the
+        'card_vector' table. Words in the content are counted apart from
+        the rest, so that the content of a card, which may be large, is
+        only split again when it changes.
+
+        The most similar cards to each card (cosine similarity of their
+        TF-IDF vectors) are stored in 'card_related'. Pending cards are
+        compared with the rest when update() is called, a few at a time,
+        and added to the lists of their similar cards, so lists are
+        approximate: a card that is modified is only kept in the lists of
+        its own similar cards. Reading the similar cards of a card only
+        reads those lists, so it does not depend on the size of the
+        archive and never writes.
+
+        Requires the same JSON support as the TagIndex. Cards with control
+        characters other than tabs and line breaks have no words.
+    """
+
+    SETUP = (
+        'CREATE TABLE IF NOT EXISTS "card_term" ('
+        '"term" TEXT NOT NULL, "card_id" INTEGER NOT NULL, '
+        '"in_content" INTEGER NOT NULL, "count" INTEGER NOT NULL, '
+        'PRIMARY KEY ("term", "card_id", "in_content")) WITHOUT ROWID',
+
+        'CREATE INDEX IF NOT EXISTS "card_term_card_id" '
+        'ON "card_term" ("card_id", "in_content")',
+
+        'CREATE TABLE IF NOT EXISTS "term_stat" ('
+        '"term" TEXT PRIMARY KEY, "cards" INTEGER NOT NULL) WITHOUT ROWID',
+
+        # A NULL norm marks the card as pending
+        'CREATE TABLE IF NOT EXISTS "card_vector" ('
+        '"card_id" INTEGER PRIMARY KEY, "norm" REAL)',
+
+        'CREATE INDEX IF NOT EXISTS "card_vector_pending" '
+        'ON "card_vector" ("card_id") WHERE "norm" IS NULL',
+
+        'CREATE TABLE IF NOT EXISTS "card_related" ('
+        '"card_id" INTEGER NOT NULL, "related_id" INTEGER NOT NULL, '
+        '"score" REAL NOT NULL, '
+        'PRIMARY KEY ("card_id", "related_id")) WITHOUT ROWID',
+
+        'CREATE INDEX IF NOT EXISTS "card_related_related_id" '
+        'ON "card_related" ("related_id")',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_term_ai" AFTER INSERT ON "card" '
+        'BEGIN ' +
+        ''.join(_count_words(*source) for source in _WORD_SOURCES) +
+        'INSERT OR IGNORE INTO "term_stat" ("term", "cards") '
+        'SELECT "term", 0 FROM "card_term" WHERE "card_id" = new."id"; '
+        'UPDATE "term_stat" SET "cards" = "cards" + 1 WHERE "term" IN '
+        '(SELECT "term" FROM "card_term" WHERE "card_id" = new."id"); '
+        'INSERT OR REPLACE INTO "card_vector" ("card_id", "norm") '
+        'VALUES (new."id", NULL); '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_term_ad" AFTER DELETE ON "card" '
+        'BEGIN '
+        'UPDATE "term_stat" SET "cards" = "cards" - 1 WHERE "term" IN '
+        '(SELECT "term" FROM "card_term" WHERE "card_id" = old."id"); '
+        'DELETE FROM "card_term" WHERE "card_id" = old."id"; '
+        'DELETE FROM "card_vector" WHERE "card_id" = old."id"; '
+        'DELETE FROM "card_related" '
+        'WHERE "card_id" = old."id" OR "related_id" = old."id"; '
+        'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_term_au_text" '
+        'AFTER UPDATE OF "title", "desc", "tags" ON "card" '
+        'WHEN old."title" IS NOT new."title" OR old."desc" IS NOT new."desc" '
+        'OR old."tags" IS NOT new."tags" '
+        'BEGIN ' + _update_words(*_WORD_SOURCES[0]) + 'END',
+
+        'CREATE TRIGGER IF NOT EXISTS "card_term_au_content" '
+        'AFTER UPDATE OF "content" ON "card" '
+        'WHEN old."content" IS NOT new."content" '
+        'BEGIN ' + _update_words(*_WORD_SOURCES[1]) + 'END',
+    )
+
+    # Created by older versions, which counted every word of a card
+    # together
+    UPGRADE = (
+        'DROP TRIGGER IF EXISTS "card_term_ai"',
+        'DROP TRIGGER IF EXISTS "card_term_ad"',
+        'DROP TRIGGER IF EXISTS "card_term_au"',
+        'DROP TABLE "card_term"',
+    )
+
+    # Number of similar cards stored for every card
+    SIZE = 20
+
+    # Words of a card (with the highest weight) used to find similar cards
+    TERMS = 20
+
+    # Words present in more cards than this are not used to find similar
+    # cards, so updating a card does not depend on the size of the archive
+    MAX_CARDS = 200
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self.available = False
+
+    def setup(self):
+        """ Create the index if needed and fill it with existing cards.
+
+            Similar cards are not computed until the next update().
+        """
+        try:
+            # Check JSON support before creating triggers that need it
+            self._db.execute_sql('SELECT 1 FROM json_each(\'[]\')')
+
+            columns = [row[1] for row in self._db.execute_sql(
+                'PRAGMA table_info("card_term")')]
+
+            if columns and "in_content" not in columns:
+                for statement in self.UPGRADE:
+                    self._db.execute_sql(statement)
+
+                columns = []
+
+            for statement in self.SETUP:
+                self._db.execute_sql(statement)
+
+            if not columns:
+                self.rebuild()
+
+        except OperationalError as e:
+            if not _unsupported(e):
+                raise
+
+            self.available = False
+            return
+
+        self.available = True
+
+    def rebuild(self):
+        """ Count the words of every card again and mark them pending. """
+        with self._db.atomic():
+            for table in ("card_term", "term_stat", "card_vector",
+                    "card_related"):
+                self._db.execute_sql('DELETE FROM "%s"' % table)
+
+            for columns, in_content in _WORD_SOURCES:
+                self._db.execute_sql(
+                    'INSERT INTO "card_term" '
+                    '("term", "card_id", "in_content", "count") '
+                    'SELECT "j"."value", "c"."id", ?, count(*) '
+                    'FROM "card" AS "c", ' +
+                    _split_words(_card_text('"c"', columns)) +
+                    ' AS "j" WHERE length("j"."value") > 2 '
+                    'GROUP BY "c"."id", "j"."value"', (in_content,))
+
+            self._db.execute_sql(
+                'INSERT INTO "term_stat" ("term", "cards") '
+                'SELECT "term", count(DISTINCT "card_id") FROM "card_term" '
+                'GROUP BY "term"')
+            self._db.execute_sql(
+                'INSERT INTO "card_vector" ("card_id", "norm") '
+                'SELECT "id", NULL FROM "card"')
+
+    def pending(self, cid=0):
+        """ Check if there are cards waiting for update(), or if the
+            given card is one of them.
+        """
+        sql = 'SELECT 1 FROM "card_vector" WHERE "norm" IS NULL'
+        params = []
+
+        if cid:
+            sql += ' AND "card_id" = ?'
+            params.append(cid)
+
+        return self._db.execute_sql(
+            sql + ' LIMIT 1', params).fetchone() is not None
+
+    def related(self, cid, limit):
+        """ Obtain the cards most similar to a card.
+
+            Pending cards are not updated, so the list of a card that has
+            not been updated yet may be empty or out of date.
+
+            cid   -- id of the card
+            limit -- maximum number of results (at most SIZE)
+
+            Returns a list of (card id, similarity) tuples, most similar
+            first.
+        """
+        return [tuple(row) for row in self._db.execute_sql(
+            'SELECT "related_id", "score" FROM "card_related" '
+            'WHERE "card_id" = ? ORDER BY "score" DESC LIMIT ?',
+            (cid, limit))]
+
+    def update(self, limit=0):
+        """ Find the similar cards of pending cards, in a single
+            transaction.
+
+            Cards left pending are not compared with the ones updated
+            now. They find them when they are updated themselves.
+
+            limit -- maximum number of cards to update (0 for all)
+
+            Returns the number of cards updated.
+        """
+        sql = ('SELECT "card_id" FROM "card_vector" WHERE "norm" IS NULL '
+            'ORDER BY "card_id"')
+        params = []
+
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self._lock:
+            pending = [row[0] for row in self._db.execute_sql(sql, params)]
+
+            if not pending:
+                return 0
+
+            ncards = self._db.execute_sql(
+                'SELECT count(*) FROM "card"').fetchone()[0]
+
+            with self._db.atomic():
+                # Norms of every pending card are needed before comparing
+                # them with each other
+                weights = {}
+
+                for cid in pending:
+                    weights[cid] = self._weights(cid, ncards)
+                    self._db.execute_sql(
+                        'UPDATE "card_vector" SET "norm" = ? '
+                        'WHERE "card_id" = ?',
+                        (self._norm(weights[cid]), cid))
+
+                for cid in pending:
+                    self._update_card(cid, weights[cid], ncards)
+
+        return len(pending)
+
+    def _norm(self, weights):
+        return math.sqrt(sum(w * w for w, _ in weights.values()))
+
+    def _update_card(self, cid, weights, ncards):
+        """ Replace the similar cards of a card. """
+        norm = self._norm(weights)
+        terms = heapq.nlargest(self.TERMS,
+            (term for term, (_, cards) in weights.items()
+                if 1 < cards <= self.MAX_CARDS),
+            key=lambda term: weights[term][0])
+
+        products = defaultdict(float)
+
+        for term in terms:
+            weight, cards = weights[term]
+            idf = math.log(ncards / cards)
+
+            for other, count in self._db.execute_sql(
+                    'SELECT "card_id", sum("count") FROM "card_term" '
+                    'WHERE "term" = ? AND "card_id" != ? '
+                    'GROUP BY "card_id"', (term, cid)):
+                products[other] += weight * (1 + math.log(count)) * idf
+
+        norms = {}
+        others = list(products)
+
+        for i in range(0, len(others), MAX_IN_PARAMS):
+            chunk = others[i:i + MAX_IN_PARAMS]
+            norms.update(self._db.execute_sql(
+                'SELECT "card_id", "norm" FROM "card_vector" '
+                'WHERE "card_id" IN (%s)' % ', '.join('?' * len(chunk)),
+                chunk))
+
+        similar = heapq.nlargest(self.SIZE,
+            ((product / (norm * norms[other]), other)
+                for other, product in products.items()
+                if norm and norms.get(other)))
+
+        self._db.execute_sql(
+            'DELETE FROM "card_related" '
+            'WHERE "card_id" = ? OR "related_id" = ?', (cid, cid))
+
+        for score, other in similar:
+            self._db.execute_sql(
+                'INSERT INTO "card_related" ("card_id", "related_id", '
+                '"score") VALUES (?, ?, ?), (?, ?, ?)',
+                (cid, other, score, other, cid, score))
+
+            # Keep only the most similar cards of the other card
+            self._db.execute_sql(
+                'DELETE FROM "card_related" WHERE "card_id" = ? AND '
+                '"related_id" NOT IN (SELECT "related_id" '
+                'FROM "card_related" WHERE "card_id" = ? '
+                'ORDER BY "score" DESC LIMIT ?)',
+                (other, other, self.SIZE))
+
+    def _weights(self, cid, ncards):
+        """ Obtain the TF-IDF weight of every word of a card.
+
+            Returns a dictionary that maps every word to its weight and
+            the number of cards that have it.
+        """
+        weights = {}
+
+        for term, count, cards in self._db.execute_sql(
+                'SELECT "t"."term", sum("t"."count"), "s"."cards" '
+                'FROM "card_term" AS "t" JOIN "term_stat" AS "s" '
+                'ON "s"."term" = "t"."term" WHERE "t"."card_id" = ? '
+                'GROUP BY "t"."term"', (cid,)):
+            weight = (1 + math.log(count)) * math.log(ncards / cards)
+
+            if weight > 0:
+                weights[term] = (weight, cards)
+
+        return weights
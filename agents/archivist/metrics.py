@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Instrumentation of the message handlers.
+
+    Every handler call is measured with the time spent waiting for the
+    archive lock, the time spent with a database connection, the rest of
+    the time (mostly formatting the reply) and the size of the reply.
+    Recording a value only takes a few operations, so measurements are
+    always enabled.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Histogram:
+    """ Histogram of non-negative integers with logarithmic buckets.
+
+        Every power of two is split in 4 buckets, so values are recorded
+        with a precision of 25%. Percentiles are approximated by the
+        upper bound of their bucket.
+    """
+
+    BUCKETS = 256
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        """ Record a value. """
+        value = int(value)
+        bits = value.bit_length()
+
+        if bits > 3:
+            # Position of the power of two and the next two bits
+            index = (bits - 3) * 4 + (value >> (bits - 3))
+
+        else:
+            index = value
+
+        self.counts[min(index, self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        """ Obtain the mean of the recorded values. """
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        """ Obtain an upper bound of the given percentile (0-100). """
+        rank = self.count * p / 100
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if count and seen >= rank:
+                return min(self.upper_bound(index), self.max)
+
+        return self.max
+
+    @staticmethod
+    def upper_bound(index):
+        """ Obtain the largest value recorded in a bucket. """
+        if index < 8:
+            return index
+
+        shift = index // 4 - 1
+
+        return ((index % 4 + 5) << shift) - 1
+
+
+class HandlerStats:
+    """ Measurements of a single handler.
+
+        Times are stored in microseconds and reply sizes in characters.
+    """
+
+    # Name, unit and scale (to convert the values to the unit)
+    FIELDS = (
+        ("total", "ms", 1000),
+        ("lock", "ms", 1000),
+        ("db", "ms", 1000),
+        ("format", "ms", 1000),
+        ("reply", "chars", 1),
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.histograms = dict(
+            (name, Histogram()) for name, unit, scale in self.FIELDS)
+
+    def lines(self):
+        """ Generate one summary line for each field. """
+        for name, unit, scale in self.FIELDS:
+            hist = self.histograms[name]
+
+            yield "  %s %s: mean %.2f, p50 %.2f, p95 %.2f, max %.2f\n" % (
+                name, unit, hist.mean() / scale,
+                hist.percentile(50) / scale, hist.percentile(95) / scale,
+                hist.max / scale)
+
+
+class Metrics:
+    """ Measurements of every handler, by name.
+
+        A handler is measured with measure(), which also collects the
+        values added with add() and add_time() in the same thread, such
+        as lock wait or database time. The time not spent waiting for the
+        lock or in the database is recorded as formatting time.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, key, value):
+        """ Add a value to the measurement of the current handler. """
+        record = getattr(self._local, "record", None)
+
+        if record is not None:
+            record[key] = record.get(key, 0) + value
+
+    def add_time(self, key, seconds):
+        """ Add a time to the measurement of the current handler. """
+        self.add(key, int(seconds * 1000000))
+
+    @contextmanager
+    def measure(self, name):
+        """ Measure a handler call. Calls may be nested. """
+        parent = getattr(self._local, "record", None)
+        record = self._local.record = {}
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            total = int((time.perf_counter() - start) * 1000000)
+            self._local.record = parent
+
+            record["total"] = total
+            record["format"] = max(
+                total - record.get("lock", 0) - record.get("db", 0), 0)
+
+            with self._lock:
+                stats = self._handlers.get(name)
+
+                if stats is None:
+                    stats = self._handlers[name] = HandlerStats()
+
+                stats.calls += 1
+
+                for key, hist in stats.histograms.items():
+                    hist.add(record.get(key, 0))
+
+    @contextmanager
+    def timer(self, key):
+        """ Add the time spent in the block to the current handler. """
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            self.add_time(key, time.perf_counter() - start)
+
+    def report(self):
+        """ Obtain a summary of every handler, as a list of lines. """
+        lines = []
+
+        with self._lock:
+            for name in sorted(self._handlers):
+                stats = self._handlers[name]
+                lines.append("- handler %s: %d calls\n" % (
+                    name, stats.calls))
+                lines.extend(stats.lines())
+
+        return lines
+
+    def start_dump(self, interval, logger):
+        """ Log the report every 'interval' seconds in a daemon thread. """
+        def dump():
+            while True:
+                time.sleep(interval)
+
+                for line in self.report():
+                    logger.info(line.rstrip("\n"))
+
+        thread = threading.Thread(target=dump)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,571 @@
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Archive used by the agent.
+
+    Imports infocards and peewee, which take a while to load, so the
+    agent only imports this module when the first connection to the
+    archive is needed.
+"""
+
+import sqlite3
+import threading
+import time
+from caches import ArchiveCache
+from collections import deque, namedtuple
+from datetime import datetime
+from itertools import islice
+from infocards.archive import Archive
+from infocards.exceptions import (ArchiveIntegrityException,
+    ArchiveOperationException)
+from infocards.models import Card, CardObj, Relation, Section, SectionObj
+from indexes import (MAX_IN_PARAMS, RelatedIndex, SearchIndex,
+    SectionSummary, TagIndex)
+from peewee import IntegrityError, SqliteDatabase
+
+
+class PooledSqliteDatabase(SqliteDatabase):
+    """ SQLite database that keeps closed connections for later reuse.
+
+        Each thread checks out its own connection when it first needs one
+        and gives it back to the pool when closing it. Connections that
+        have been idle for more than 'check_after' seconds are verified
+        before being handed out again.
+    """
+
+    def __init__(self, database, size=4, check_after=60, **kwargs):
+        # Connections are shared among threads, but never at the same time
+        kwargs.setdefault("check_same_thread", False)
+        super().__init__(database, **kwargs)
+
+        self._size = size
+        self._check_after = check_after
+        self._idle = deque()
+        self._idle_lock = threading.Lock()
+
+    def _connect(self, database, **kwargs):
+        while True:
+            with self._idle_lock:
+                if not self._idle:
+                    break
+
+                conn, since = self._idle.pop()
+
+            if time.time() - since < self._check_after or self._healthy(conn):
+                return conn
+
+            try:
+                conn.close()
+
+            except sqlite3.Error:
+                pass
+
+        return super()._connect(database, **kwargs)
+
+    def _close(self, conn):
+        with self._idle_lock:
+            if len(self._idle) < self._size:
+                self._idle.append((conn, time.time()))
+                return
+
+        super()._close(conn)
+
+    def _healthy(self, conn):
+        """ Check that an idle connection is still usable. """
+        try:
+            conn.execute("SELECT 1").fetchone()
+
+        except sqlite3.Error:
+            return False
+
+        return True
+
+
+class CardRow(namedtuple("CardRow", ["id", "title", "desc"])):
+    """ Fields of a card shown when listing cards.
+
+        Rows are read without the content of the card, which may be large.
+    """
+
+    __slots__ = ()
+
+
+class AgentArchive(Archive):
+    """ Archive extended with the queries needed by the agent.
+
+        Uses a PooledSqliteDatabase for its connections unless the pool
+        size is 0. If 'wal' is set, the database is switched to
+        write-ahead logging, so that readers are not blocked while a
+        transaction is being written.
+
+        Cards and sections are cached in 'cache' (an ArchiveCache, none
+        by default). Every index is set up when the archive is created,
+        before any handler reads from it, so that creating their tables
+        and triggers never overlaps an open cursor.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        if kwargs.get("wal"):
+            self.db.execute_sql("PRAGMA journal_mode=WAL")
+
+        self._cache = kwargs.get("cache")
+        if self._cache is None:
+            self._cache = ArchiveCache(0)
+
+        self.index = SearchIndex(self.db)
+        self.index.setup()
+
+        self.related_index = RelatedIndex(self.db)
+        self.related_index.setup()
+
+        self.tag_index = TagIndex(self.db)
+        self.tag_index.setup()
+
+        self.summary = SectionSummary(self.db)
+        self.summary.setup()
+
+    def _init_db(self, **kwargs):
+        size = kwargs.get("pool_size", 4)
+
+        if not size:
+            return SqliteDatabase(kwargs["db_name"])
+
+        return PooledSqliteDatabase(
+            kwargs["db_name"],
+            size=size,
+            check_after=kwargs.get("pool_check", 60))
+
+    def cards(self, limit=0, offset=0):
+        """ Obtain the cards in the archive, ordered by id.
+
+            limit  -- maximum number of cards to return (0 for all)
+            offset -- number of cards to skip
+
+            Returns a generator.
+        """
+        cards = Card.select().order_by(Card.id)
+
+        if limit:
+            cards = cards.limit(limit).offset(offset)
+
+        for card in cards:
+            yield CardObj(card)
+
+    def card_rows(self, sid=0, limit=0, offset=0):
+        """ Obtain the id, title and description of cards, ordered by id.
+
+            sid    -- optional section id to list only its cards
+            limit  -- maximum number of cards to return (0 for all)
+            offset -- number of cards to skip
+
+            Returns a list of CardRow.
+        """
+        rows = Card.select(Card.id, Card.title, Card.desc)
+
+        if sid:
+            rows = rows.join(Relation).where(Relation.section == sid)
+
+        rows = rows.order_by(Card.id)
+
+        if limit:
+            rows = rows.limit(limit).offset(offset)
+
+        return [CardRow._make(row) for row in rows.tuples()]
+
+    def card_section_names(self, cid):
+        """ Obtain the names of the sections a card appears in.
+
+            Results are cached.
+        """
+        def load():
+            sections = (Section
+                .select(Section.name)
+                .join(Relation)
+                .where(Relation.card == cid)
+                .order_by(Section.name))
+
+            return [section.name for section in sections]
+
+        return self._cache.card_sections.load(cid, load)
+
+    def get_card(self, cid=0, title=""):
+        """ Obtain a specific card from the archive.
+
+            Cards obtained by id are cached.
+        """
+        if not cid:
+            return super().get_card(title=title)
+
+        return self._cache.cards.load(cid,
+            lambda: super(AgentArchive, self).get_card(cid=cid))
+
+    def get_cards(self, cids):
+        """ Obtain several cards at once.
+
+            Cached cards are reused and the rest are obtained with a
+            single query.
+
+            cids -- iterable of card ids
+
+            Returns a dictionary that maps the id of every card found to
+            the card itself.
+        """
+        found = {}
+        missing = []
+
+        for cid in set(cids):
+            card = self._cache.cards.load(cid, lambda: None)
+
+            if card:
+                found[cid] = card
+
+            else:
+                missing.append(cid)
+
+        for i in range(0, len(missing), MAX_IN_PARAMS):
+            chunk = missing[i:i + MAX_IN_PARAMS]
+
+            for card in Card.select().where(Card.id << chunk):
+                found[card.id] = CardObj(card)
+                self._cache.cards.put(card.id, found[card.id])
+
+        return found
+
+    def get_card_rows(self, cids):
+        """ Obtain the id, title and description of several cards at once.
+
+            Cached cards are reused and the rest are obtained with a
+            single query that does not read their content. Rows are not
+            cached.
+
+            cids -- iterable of card ids
+
+            Returns a dictionary that maps the id of every card found to
+            its CardRow.
+        """
+        found = {}
+        missing = []
+
+        for cid in set(cids):
+            card = self._cache.cards.load(cid, lambda: None)
+
+            if card:
+                found[cid] = CardRow(card.id, card.title, card.desc)
+
+            else:
+                missing.append(cid)
+
+        for i in range(0, len(missing), MAX_IN_PARAMS):
+            chunk = missing[i:i + MAX_IN_PARAMS]
+            rows = (Card
+                .select(Card.id, Card.title, Card.desc)
+                .where(Card.id << chunk)
+                .tuples())
+
+            for row in rows:
+                found[row[0]] = CardRow._make(row)
+
+        return found
+
+    def get_section(self, name="", sid=0):
+        """ Obtain a specific section from the archive.
+
+            Sections obtained by name are cached.
+        """
+        if not name:
+            return super().get_section(sid=sid)
+
+        return self._cache.sections.load(name,
+            lambda: super(AgentArchive, self).get_section(name=name))
+
+    def import_cards(self, cards, author="UNKNOWN"):
+        """ Add several cards to the archive in a single transaction.
+
+            Sections that do not exist are created. Each card is inserted
+            in its own savepoint, together with its new sections, so a
+            card that cannot be added (for instance, because its title is
+            already in use) neither leaves its sections behind nor
+            prevents the rest from being imported.
+
+            cards  -- iterable of dictionaries with the keys 'title',
+                      'desc', 'content', 'tags' and 'sections' (list
+                      of names)
+            author -- optional name of the author of the cards
+
+            Returns a list of (title, card id, error) tuples, in the order
+            the cards were given. The id is None if the card could not be
+            added, and the error is None otherwise.
+        """
+        results = []
+        modified = datetime.now()
+
+        with self.db.atomic():
+            sections = dict(Section.select(Section.name, Section.id).tuples())
+
+            for attrs in cards:
+                title = attrs['title'].strip()
+                names = attrs['sections']
+                # Sections created for this card, only kept if it is added
+                created = {}
+
+                try:
+                    if not title:
+                        raise ValueError("missing title")
+
+                    with self.db.atomic():
+                        for name in names:
+                            if name not in sections and name not in created:
+                                created[name] = Section.create(name=name).id
+
+                        card = Card.create(
+                            title=title,
+                            desc=attrs['desc'],
+                            content=attrs['content'],
+                            tags=attrs['tags'],
+                            modified=modified,
+                            modified_by=author)
+
+                        for sid in set(sections.get(name) or created[name]
+                                for name in names):
+                            Relation.create(card=card.id, section=sid)
+
+                except (IntegrityError, ValueError) as e:
+                    results.append((title, None, str(e)))
+                    continue
+
+                sections.update(created)
+                results.append((title, card.id, None))
+
+        return results
+
+    def new_card(self, title, desc, content, tags, author="UNKNOWN"):
+        """ Add a new card to the archive.
+
+            Unlike infocards, a failed insertion does not roll back the
+            current transaction, which may hold other handlers' changes
+            when commits are grouped.
+        """
+        try:
+            return CardObj(Card.create(
+                title=title,
+                desc=desc,
+                content=content,
+                tags=tags,
+                modified=datetime.now(),
+                modified_by=author))
+
+        except IntegrityError as e:
+            raise ArchiveIntegrityException(str(e))
+
+    def new_section(self, name):
+        """ Create a new section in the archive.
+
+            A failed insertion does not roll back the current transaction
+            (see new_card).
+        """
+        try:
+            return SectionObj(Section.create(name=name))
+
+        except IntegrityError as e:
+            raise ArchiveIntegrityException(str(e))
+
+    def related_cards(self, cid, limit=5):
+        """ Obtain the cards most similar to a card.
+
+            cid   -- id of the card
+            limit -- maximum number of cards to return
+
+            Returns a list of CardRow, most similar first.
+        """
+        if not self.related_index.available:
+            raise RuntimeError("related index not available")
+
+        cids = [other for other, _ in self.related_index.related(cid, limit)]
+        cards = self.get_card_rows(cids)
+
+        return [cards[other] for other in cids if other in cards]
+
+    def rename_section(self, newname, oldname="", sid=0):
+        """ Rename a section.
+
+            A failed update does not roll back the current transaction
+            (see new_card).
+
+            Returns the new section.
+        """
+        try:
+            if oldname:
+                section = Section.get(Section.name == oldname)
+
+            elif sid:
+                section = Section.get(Section.id == sid)
+
+            else:
+                return None
+
+        except Section.DoesNotExist:
+            raise ArchiveOperationException('section does not exist')
+
+        section.name = newname
+
+        try:
+            section.save()
+
+        except IntegrityError as e:
+            raise ArchiveIntegrityException(str(e))
+
+        return SectionObj(section)
+
+    def search(self, query, sname="", sid=0, likelihood=80, relevance=50,
+        limit=0, offset=0, rows=False):
+        """ Search for relevant cards in the archive.
+
+            The full-text index is used when available and results are
+            sorted by relevance. The fuzzy search of infocards, which
+            reads every card, is only used if SQLite lacks FTS5.
+
+            limit  -- maximum number of cards to return (0 for all)
+            offset -- number of cards to skip
+            rows   -- obtain CardRow instead of full cards. The fuzzy
+                      search still reads whole cards
+
+            Returns a generator.
+        """
+        if self.index.available:
+            if sname and not sid:
+                section = self.get_section(name=sname)
+
+                if not section:
+                    return
+
+                sid = section.id
+
+            cids = self.index.search(query, sid=sid, limit=limit,
+                offset=offset)
+
+            if rows:
+                cards = self.get_card_rows(cids)
+
+            else:
+                cards = self.get_cards(cids)
+
+            for cid in cids:
+                if cid in cards:
+                    yield cards[cid]
+
+            return
+
+        cards = super().search(query, sname=sname, sid=sid,
+            likelihood=likelihood, relevance=relevance)
+        cards = islice(cards, offset, offset + limit if limit else None)
+
+        if rows:
+            cards = (CardRow(c.id, c.title, c.desc) for c in cards)
+
+        yield from cards
+
+    def section_summary(self):
+        """ Obtain the name, number of cards and latest modification date
+            of the cards of every section, ordered by id.
+
+            No card is loaded. Results are cached.
+        """
+        return self._cache.section_list.load("all", self.summary.sections)
+
+    def section_cards(self, sid, limit=0, offset=0):
+        """ Obtain the cards in a section, ordered by id.
+
+            sid    -- section id
+            limit  -- maximum number of cards to return (0 for all)
+            offset -- number of cards to skip
+
+            Returns a generator.
+        """
+        cards = (Card
+            .select()
+            .join(Relation)
+            .where(Relation.section == sid)
+            .order_by(Card.id))
+
+        if limit:
+            cards = cards.limit(limit).offset(offset)
+
+        for card in cards:
+            yield CardObj(card)
+
+    def tag_cards(self, query, limit=0, offset=0):
+        """ Obtain the cards that match a tag query, ordered by id.
+
+            query  -- tags joined by AND or OR (see TagIndex.parse_query)
+            limit  -- maximum number of cards to return (0 for all)
+            offset -- number of cards to skip
+
+            Returns a tuple with the list of CardRow and the total number
+            of matching cards.
+        """
+        if not self.tag_index.available:
+            raise RuntimeError("tag index not available")
+
+        cids, total = self.tag_index.cards(query, limit=limit,
+            offset=offset)
+        cards = self.get_card_rows(cids)
+
+        return [cards[cid] for cid in cids if cid in cards], total
+
+    def tag_counts(self, limit=0, offset=0):
+        """ Obtain the tags in the archive and the number of cards that
+            have each one, ordered by tag.
+
+            limit  -- maximum number of tags to return (0 for all)
+            offset -- number of tags to skip
+
+            Returns a list of (tag, count) tuples.
+        """
+        if not self.tag_index.available:
+            raise RuntimeError("tag index not available")
+
+        return self.tag_index.tags(limit=limit, offset=offset)
+
+    def update_card(self, cid, author="UNKNOWN", **fields):
+        """ Modify some fields of a card with a single UPDATE statement.
+
+            Fields that are not given or are empty keep their value and
+            are never read.
+
+            cid    -- id of the card to modify
+            author -- author of the modification
+            fields -- new 'title', 'desc', 'content' and/or 'tags'
+
+            Returns True if the card exists and was modified.
+        """
+        values = dict((getattr(Card, name), value)
+            for name, value in fields.items() if value)
+
+        values[Card.modified] = datetime.now()
+        values[Card.modified_by] = author
+
+        return Card.update(values).where(Card.id == cid).execute() > 0
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Shared helpers for the benchmarks.
+
+    The agent is loaded outside of Zoe: a temporary ZOE_HOME is created
+    and the 'zoe' package is replaced by a minimal stand-in that only
+    provides what the agent uses. Infocards must be installed.
+"""
+
+import base64
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENT_DIR = os.path.join(ROOT, "agents", "archivist")
+
+WORDS = (
+    "python docker postgres tuning asyncio linux kernel network cache "
+    "index query thread lock mail jabber bookmark recipe music video "
+    "design pattern compiler parser socket server client archive card "
+    "section search cluster backup storage vector matrix graph tree"
+).split()
+
+USERS_CONF = """
+[group archivists]
+members = admin
+
+[subject admin]
+name = Admin
+locale = en
+preferred = jabber
+
+[subject user1]
+name = User
+locale = es
+preferred = mail
+"""
+
+
+class MessageBuilder:
+    """ Stand-in for zoe.MessageBuilder, keeps the map for inspection. """
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+    def msg(self):
+        return "&".join("%s=%s" % (k, v) for k, v in self.attrs.items())
+
+
+class Attachment:
+    """ Stand-in for zoe.Attachment, encoded in base64 like the original. """
+
+    def __init__(self, binary, mimetype, filename):
+        self.binary = binary
+        self.mimetype = mimetype
+        self.filename = filename
+
+    def str(self):
+        return "%s/%s/%s" % (self.mimetype, self.filename,
+            base64.standard_b64encode(self.binary).decode("ascii"))
+
+
+class Users:
+    """ Stand-in for zoe.models.users.Users reading zoe-users.conf. """
+
+    def __init__(self):
+        import configparser
+        self._conf = configparser.ConfigParser()
+        self._conf.read(os.path.join(
+            os.environ["ZOE_HOME"], "etc", "zoe-users.conf"))
+
+    def subject(self, name):
+        key = "subject " + name
+        if not self._conf.has_section(key):
+            return {}
+        return dict(self._conf.items(key))
+
+    def membersof(self, group):
+        key = "group " + group
+        if not self._conf.has_section(key):
+            return []
+        return self._conf.get(key, "members").split()
+
+
+def _install_zoe_stub():
+    """ Register a fake 'zoe' package in sys.modules. """
+    zoe = types.ModuleType("zoe")
+    zoe.MessageBuilder = MessageBuilder
+    zoe.Attachment = Attachment
+
+    deco = types.ModuleType("zoe.deco")
+
+    def Agent(name):
+        def wrap(cls):
+            cls.logger = logging.getLogger(name)
+            return cls
+        return wrap
+
+    def Message(tags):
+        def wrap(func):
+            func.tags = tags
+            return func
+        return wrap
+
+    deco.Agent = Agent
+    deco.Message = Message
+
+    models = types.ModuleType("zoe.models")
+    users = types.ModuleType("zoe.models.users")
+    users.Users = Users
+
+    zoe.deco = deco
+    zoe.models = models
+    models.users = users
+
+    sys.modules.update({
+        "zoe": zoe,
+        "zoe.deco": deco,
+        "zoe.models": models,
+        "zoe.models.users": users,
+    })
+
+
+class FakeParser:
+    """ Stand-in for the zoe message parser. """
+
+    def __init__(self, **values):
+        self._values = values
+
+    def get(self, key):
+        return self._values.get(key)
+
+
+def load_agent(db_path=None, options=None):
+    """ Create a temporary ZOE_HOME and import the agent module.
+
+        Returns the module and an instance of the agent.
+    """
+    home = tempfile.mkdtemp(prefix="archivist-bench-")
+    os.makedirs(os.path.join(home, "etc"))
+    os.symlink(os.path.join(ROOT, "locale"), os.path.join(home, "locale"))
+
+    db_path = db_path or os.path.join(home, "archive.sqlite")
+
+    with open(os.path.join(home, "etc", "archivist.conf"), "w") as f:
+        f.write(db_path + "\n")
+        for key, value in (options or {}).items():
+            f.write("%s = %s\n" % (key, value))
+
+    with open(os.path.join(home, "etc", "zoe-users.conf"), "w") as f:
+        f.write(USERS_CONF)
+
+    os.environ["ZOE_HOME"] = home
+    os.environ.setdefault("ZOE_LOCALE", "en")
+
+    _install_zoe_stub()
+
+    if AGENT_DIR not in sys.path:
+        sys.path.insert(0, AGENT_DIR)
+
+    sys.modules.pop("archivist", None)
+    import archivist
+
+    return archivist, archivist.Archivist()
+
+
+def populate(db_path, ncards, nsections=10, seed=0, content_words=60):
+    """ Fill an archive with synthetic cards, spread among sections. """
+    from infocards.archive import Archive
+    Archive(db_type="sqlite", db_name=db_path)
+
+    rnd = random.Random(seed)
+    now = datetime.now()
+
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            'INSERT INTO "card" ("title", "desc", "content", "tags", '
+            '"modified", "modified_by") VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                (
+                    "card %d %s" % (i, " ".join(rnd.sample(WORDS, 3))),
+                    " ".join(rnd.sample(WORDS, 8)),
+                    " ".join(rnd.choice(WORDS) for _ in range(content_words)),
+                    " ".join(rnd.sample(WORDS, 4)),
+                    now,
+                    "bench"
+                ) for i in range(ncards)
+            ))
+
+        conn.executemany(
+            'INSERT INTO "section" ("name") VALUES (?)',
+            (("section%d" % i,) for i in range(nsections)))
+
+        conn.executemany(
+            'INSERT INTO "relation" ("section_id", "card_id") VALUES (?, ?)',
+            ((cid % nsections + 1, cid) for cid in range(1, ncards + 1)))
+
+    conn.close()
+
+
+def timed(func, *args, **kwargs):
+    """ Run a function and return its result and elapsed seconds. """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Connection pool benchmark.
+
+    Measures messages per second for 'card-list' and 'get-cards' when a
+    new archive is opened for every message (pool_size = 0) and when the
+    pooled archive is used.
+
+    Usage: python3 bench/connections.py [--cards N] [--messages N]
+"""
+
+import argparse
+import os
+import tempfile
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=50)
+parser.add_argument('--messages', type=int, default=500)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    common.populate(db_path, args.cards)
+
+    print("%-12s %-10s %12s" % ("tag", "pool_size", "msg/s"))
+
+    for size in (0, 4):
+        _, agent = common.load_agent(db_path, {"pool_size": size})
+
+        messages = (
+            ("card-list", agent.card_list, common.FakeParser(sender="admin")),
+            ("get-cards", agent.get_cards, common.FakeParser(
+                cids="1 2 3", sender="admin")),
+        )
+
+        for tag, handler, msg in messages:
+            _, elapsed = common.timed(
+                lambda: [handler(msg) for _ in range(args.messages)])
+            print("%-12s %-10d %12.1f" % (tag, size, args.messages / elapsed))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Dispatch latency benchmark.
+
+    A local TCP server stands in for the Zoe server and records when each
+    reply arrives. A slow 'get-section' by mail is sent first, followed by
+    quick 'section-list' messages from other users, and the latency of
+    the quick messages is reported in synchronous and asynchronous mode.
+
+    Usage: python3 bench/dispatch.py [--cards N] [--quick N] [--workers N]
+"""
+
+import argparse
+import os
+import socketserver
+import statistics
+import tempfile
+import threading
+import time
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=20000)
+parser.add_argument('--quick', type=int, default=50)
+parser.add_argument('--workers', type=int, default=4)
+
+
+class FakeZoe(socketserver.ThreadingTCPServer):
+    """ Records the time at which a message for each user arrives. """
+
+    daemon_threads = True
+    request_queue_size = 128
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeZoeHandler)
+        self.arrivals = {}
+        self.received = threading.Condition()
+
+
+class FakeZoeHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        data = self.rfile.read().decode("utf-8")
+        fields = dict(f.split("=", 1) for f in data.split("&") if "=" in f)
+
+        with self.server.received:
+            self.server.arrivals[fields.get("to")] = time.perf_counter()
+            self.server.received.notify_all()
+
+
+def run(archivist, agent, server, nquick):
+    """ Send the messages and return the latency of each quick one. """
+    server.arrivals.clear()
+    users = ["user%d" % i for i in range(nquick)]
+
+    # Every message is considered received at the same time
+    start = time.perf_counter()
+
+    def deliver(replies):
+        # In synchronous mode Zoe sends whatever the handler returns
+        if not replies:
+            return
+
+        for reply in replies if isinstance(replies, tuple) else (replies,):
+            if reply:
+                archivist.sendbus(reply)
+
+    deliver(agent.get_section(common.FakeParser(
+        sname="section1", method="mail", sender="slow", src="jabber")))
+
+    for user in users:
+        deliver(agent.section_list(common.FakeParser(
+            sender=user, src="jabber")))
+
+    with server.received:
+        server.received.wait_for(
+            lambda: all(u in server.arrivals for u in users), timeout=60)
+
+    return [(server.arrivals[u] - start) * 1000 for u in users]
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    common.populate(db_path, args.cards, nsections=2)
+
+    server = FakeZoe()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["ZOE_SERVER_HOST"] = "127.0.0.1"
+    os.environ["ZOE_SERVER_PORT"] = str(server.server_address[1])
+
+    print("%-6s %12s %12s %12s" % ("mode", "p50 (ms)", "p95 (ms)", "max (ms)"))
+
+    for mode, workers in (("sync", 0), ("async", args.workers)):
+        archivist, agent = common.load_agent(
+            db_path, {"async_workers": workers})
+
+        latencies = sorted(run(archivist, agent, server, args.quick))
+
+        print("%-6s %12.1f %12.1f %12.1f" % (
+            mode,
+            statistics.median(latencies),
+            latencies[int(len(latencies) * 0.95) - 1],
+            latencies[-1]))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Group commit benchmark.
+
+    Sends a burst of 'new-card' and 'add-section' messages and measures
+    the time until every reply has been sent, committing each message on
+    its own (with and without write-ahead logging) and grouping commits
+    with the given windows.
+
+    Usage: python3 bench/groupcommit.py [--cards N] [--windows 2,5,20]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=200)
+parser.add_argument('--windows', default='2,5,20',
+    help='group commit windows to measure, in milliseconds')
+
+
+def burst(archivist, agent, ncards):
+    """ Send the messages and wait for every reply. """
+    replies = []
+    done = threading.Condition()
+
+    def collect(reply):
+        with done:
+            replies.append(reply)
+            done.notify_all()
+
+    if archivist.WRITER:
+        archivist.WRITER._send = collect
+
+    def deliver(reply):
+        # Without group commit, Zoe sends whatever the handler returns
+        if reply:
+            collect(reply)
+
+    for i in range(ncards):
+        deliver(agent.new_card(common.FakeParser(
+            title="burst %d" % i, desc="description", content="content",
+            tags="bench", sender="admin")))
+        deliver(agent.add_card_to_section(common.FakeParser(
+            cid=str(i + 1), sname="section0", sender="admin", src="jabber")))
+
+    with done:
+        done.wait_for(lambda: len(replies) >= 2 * ncards, timeout=600)
+
+    return replies
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    runs = [(0, "no"), (0, "yes")] + [
+        (int(w), "yes") for w in args.windows.split(',')]
+
+    print("%-12s %-6s %10s %12s" % ("window (ms)", "wal", "seconds", "msg/s"))
+
+    for window, wal in runs:
+        db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+        common.populate(db_path, 0, nsections=1)
+
+        archivist, agent = common.load_agent(
+            db_path, {"group_commit": window, "wal": wal})
+
+        replies, elapsed = common.timed(burst, archivist, agent, args.cards)
+        errors = sum(1 for r in replies if "Error" in r.attrs["msg"])
+
+        print("%-12d %-6s %10.2f %12.1f%s" % (
+            window, wal, elapsed,
+            len(replies) / elapsed, " (%d errors)" % errors if errors else ""))
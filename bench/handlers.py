@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Message handler benchmark.
+
+    Runs the most common handlers of the agent against generated archives
+    of the given sizes and saves the results as JSON, so that they can be
+    compared between versions. Replies are serialized as they would be to
+    be sent to the Zoe server. Archives, card ids and queries are generated
+    from a fixed seed, so runs with the same arguments are reproducible.
+
+    Read-only handlers are measured before the ones that modify the
+    archive.
+
+    Usage: python3 bench/handlers.py [--sizes 1000,10000] [--calls 200]
+                                     [--output results.json]
+                                     [--compare baseline.json]
+                                     [--option key=value ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', default='1000,10000')
+parser.add_argument('--calls', type=int, default=200,
+    help='number of calls to each handler')
+parser.add_argument('--section-size', type=int, default=100,
+    help='average number of cards in each section')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--output', default='handlers.json')
+parser.add_argument('--compare',
+    help='results of a previous run to compare with')
+parser.add_argument('--option', action='append', default=[],
+    help='agent setting, such as cache_size=0 (may be repeated)')
+
+HANDLERS = ('search', 'card_list', 'get_cards', 'get_section', 'new_card',
+    'modify_card')
+
+
+def messages(handler, size, nsections, calls, rnd):
+    """ Generate the parsers of the messages sent to a handler. """
+    for i in range(calls):
+        if handler == 'search':
+            yield common.FakeParser(
+                query=" ".join(rnd.sample(common.WORDS, 2)),
+                sender="admin", src="jabber")
+
+        elif handler == 'card_list':
+            yield common.FakeParser(sender="admin", src="jabber")
+
+        elif handler == 'get_cards':
+            cids = " ".join(str(rnd.randint(1, size)) for _ in range(3))
+            yield common.FakeParser(cids=cids, sender="admin", src="jabber")
+
+        elif handler == 'get_section':
+            yield common.FakeParser(
+                sname="section%d" % rnd.randrange(nsections),
+                sender="admin", src="jabber")
+
+        elif handler == 'new_card':
+            yield common.FakeParser(title="bench card %d" % i,
+                desc=" ".join(rnd.sample(common.WORDS, 8)),
+                content=" ".join(rnd.choice(common.WORDS) for _ in range(60)),
+                tags=" ".join(rnd.sample(common.WORDS, 4)), sender="admin")
+
+        elif handler == 'modify_card':
+            yield common.FakeParser(cid=str(rnd.randint(1, size)),
+                desc=" ".join(rnd.sample(common.WORDS, 8)),
+                content=" ".join(rnd.choice(common.WORDS) for _ in range(60)),
+                sender="admin", src="jabber")
+
+
+def send(replies):
+    """ Serialize the replies like the Zoe relay. """
+    if not isinstance(replies, tuple):
+        replies = (replies,)
+
+    return sum(len(reply.msg()) for reply in replies if reply)
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def run(size, args, options):
+    """ Measure every handler on an archive with 'size' cards. """
+    nsections = max(size // args.section_size, 1)
+    db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    common.populate(db_path, size, nsections, seed=args.seed)
+
+    _, agent = common.load_agent(db_path, options)
+
+    # Open the archive and build its indexes before measuring
+    send(agent.card_list(common.FakeParser(sender="admin", src="jabber")))
+
+    results = []
+
+    for handler in HANDLERS:
+        rnd = random.Random("%s-%d-%d" % (handler, size, args.seed))
+        times = []
+        sent = 0
+
+        for msg in messages(handler, size, nsections, args.calls, rnd):
+            start = time.perf_counter()
+            sent += send(getattr(agent, handler)(msg))
+            times.append((time.perf_counter() - start) * 1000)
+
+        total = sum(times)
+        times.sort()
+
+        results.append({
+            "size": size,
+            "handler": handler,
+            "calls": len(times),
+            "mean_ms": total / len(times),
+            "p50_ms": percentile(times, 50),
+            "p95_ms": percentile(times, 95),
+            "max_ms": times[-1],
+            "calls_per_s": len(times) / (total / 1000),
+            "reply_chars": sent / len(times),
+        })
+
+    return results
+
+
+def revision():
+    """ Obtain the git revision of the repository, if available. """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=common.ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """ Print the change of the median time of every handler. """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    previous = dict(
+        ((r["size"], r["handler"]), r) for r in baseline["results"])
+
+    print("\nCompared to %s (%s):" % (
+        baseline_path, baseline["meta"].get("revision")))
+    print("%-10s %-12s %12s %12s %9s" % (
+        "cards", "handler", "before (ms)", "after (ms)", "change"))
+
+    for r in results:
+        old = previous.get((r["size"], r["handler"]))
+
+        if not old:
+            continue
+
+        print("%-10d %-12s %12.3f %12.3f %+8.1f%%" % (
+            r["size"], r["handler"], old["p50_ms"], r["p50_ms"],
+            (r["p50_ms"] / old["p50_ms"] - 1) * 100))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    options = dict(o.split("=", 1) for o in args.option)
+
+    results = []
+
+    print("%-10s %-12s %10s %10s %10s %10s" % (
+        "cards", "handler", "mean (ms)", "p50 (ms)", "p95 (ms)", "calls/s"))
+
+    for size in [int(n) for n in args.sizes.split(',')]:
+        for r in run(size, args, options):
+            print("%-10d %-12s %10.3f %10.3f %10.3f %10.1f" % (
+                r["size"], r["handler"], r["mean_ms"], r["p50_ms"],
+                r["p95_ms"], r["calls_per_s"]))
+            results.append(r)
+
+    meta = {
+        "revision": revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+
+    print("\nResults saved to %s" % args.output)
+
+    if args.compare:
+        compare(results, args.compare)
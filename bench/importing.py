@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Bulk import benchmark.
+
+    Measures the time needed to add N cards (each one in two sections)
+    with one 'new-card' and two 'add-section' messages per card, and
+    with a single 'import-cards' message.
+
+    Usage: python3 bench/importing.py [--cards N]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=500)
+
+
+def generate(ncards, seed=0):
+    """ Generate the cards to add, as dictionaries. """
+    rnd = random.Random(seed)
+
+    for i in range(ncards):
+        yield {
+            "title": "bookmark %d" % i,
+            "desc": " ".join(rnd.sample(common.WORDS, 6)),
+            "content": " ".join(rnd.choice(common.WORDS) for _ in range(40)),
+            "tags": " ".join(rnd.sample(common.WORDS, 3)),
+            "sections": "section%d section%d" % (i % 10, 10 + i % 5),
+        }
+
+
+def one_by_one(agent, cards):
+    # The archive starts empty, so ids are given in order
+    for cid, card in enumerate(cards, 1):
+        agent.new_card(common.FakeParser(
+            title=card["title"], desc=card["desc"], content=card["content"],
+            tags=card["tags"], sender="admin"))
+
+        for name in card["sections"].split():
+            agent.add_card_to_section(common.FakeParser(
+                cid=str(cid), sname=name, sender="admin"))
+
+
+def bulk(agent, cards):
+    fd, file_path = tempfile.mkstemp(suffix=".jsonl")
+
+    with os.fdopen(fd, "w") as f:
+        for card in cards:
+            f.write(json.dumps(card) + "\n")
+
+    agent.import_cards(common.FakeParser(
+        file=file_path, remove="yes", sender="admin"))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    cards = list(generate(args.cards))
+
+    print("%-14s %8s %10s %12s" % ("mode", "cards", "seconds", "cards/s"))
+
+    for mode, run in (("new-card", one_by_one), ("import-cards", bulk)):
+        db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+        _, agent = common.load_agent(db_path)
+
+        if mode == "new-card":
+            # Sections must exist before adding cards to them
+            for name in sorted(set(" ".join(
+                    c["sections"] for c in cards).split())):
+                agent.new_section(common.FakeParser(
+                    name=name, sender="admin"))
+
+        _, elapsed = common.timed(run, agent, cards)
+        print("%-14s %8d %10.2f %12.1f" % (
+            mode, len(cards), elapsed, len(cards) / elapsed))
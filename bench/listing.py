@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Card listing benchmark.
+
+    Lists every card of a synthetic archive reading whole cards, as
+    card-list used to do, and reading only the id, title and description
+    of each card, as it does now.
+
+    Usage: python3 bench/listing.py [--cards 100000] [--content 2000]
+"""
+
+import argparse
+import os
+import tempfile
+import tracemalloc
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=100000)
+parser.add_argument('--content', type=int, default=2000,
+    help='approximate size of the content of each card, in characters')
+
+
+def measure(func, *args):
+    """ Return elapsed milliseconds and peak allocated MiB. """
+    tracemalloc.start()
+    _, elapsed = common.timed(func, *args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed * 1000, peak / (1024 * 1024)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    common.populate(db_path, args.cards, content_words=args.content // 7)
+
+    _, agent = common.load_agent(db_path)
+
+    import store
+    ar = store.AgentArchive(db_type="sqlite", db_name=db_path, pool_size=1)
+
+    runs = (
+        ("cards", lambda: list(agent.card_lines(list(ar.cards())))),
+        ("rows", lambda: list(agent.card_lines(ar.card_rows()))),
+    )
+
+    print("%-8s %12s %12s" % ("method", "time (ms)", "peak (MiB)"))
+
+    for name, func in runs:
+        elapsed, peak = measure(func)
+        print("%-8s %12.1f %12.1f" % (name, elapsed, peak))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Lock contention benchmark.
+
+    Runs read-only handlers from several threads at once and reports the
+    aggregated throughput for the 'rw' and 'global' locking modes.
+
+    Two workloads are measured: 'mixed' (get-cards, section-list and
+    section-cards) and 'search', made only of searches. The caches of the
+    agent are disabled so that every message reaches the database, and
+    every mode is warmed up before measuring, so that opening the archive
+    is not counted.
+
+    Usage: python3 bench/locking.py [--cards N] [--ops N] [--threads 1,2,4,8]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=2000)
+parser.add_argument('--ops', type=int, default=50,
+    help='read messages sent by each thread')
+parser.add_argument('--threads', default='1,2,4,8')
+
+
+def workloads(agent):
+    """ Obtain the messages of every workload, by name. """
+    return {
+        "mixed": [
+            (agent.get_cards, common.FakeParser(cids="1 2 3 4 5",
+                sender="admin")),
+            (agent.section_list, common.FakeParser(sender="admin")),
+            (agent.section_cards, common.FakeParser(name="section1",
+                sender="admin")),
+        ],
+        "search": [
+            (agent.search, common.FakeParser(query=query, sender="admin"))
+            for query in ("python", "docker postgres", "linux kernel",
+                "cache index query", "mail", "thread lock", "graph tree")
+        ],
+    }
+
+
+def run(messages, nthreads, nops):
+    """ Send 'nops' of the given messages from each of 'nthreads'
+        threads.
+    """
+    barrier = threading.Barrier(nthreads + 1)
+
+    def worker():
+        barrier.wait()
+        for i in range(nops):
+            handler, msg = messages[i % len(messages)]
+            handler(msg)
+
+    threads = [threading.Thread(target=worker) for _ in range(nthreads)]
+    for t in threads:
+        t.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+
+    for t in threads:
+        t.join()
+
+    return (nthreads * nops) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    common.populate(db_path, args.cards)
+
+    print("%-8s %-8s %8s %12s" % ("workload", "mode", "threads", "msg/s"))
+
+    for mode in ("global", "rw"):
+        _, agent = common.load_agent(db_path, {"lock": mode,
+            "cache_size": 0})
+
+        for name, messages in workloads(agent).items():
+            # Warm up: open the archive and fill the caches of SQLite
+            run(messages, 1, len(messages))
+
+            for nthreads in [int(n) for n in args.threads.split(",")]:
+                rate = run(messages, nthreads, args.ops)
+                print("%-8s %-8s %8d %12.1f" % (name, mode, nthreads, rate))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Mail body parser fuzzing and benchmark.
+
+    Generates a corpus of mails with the fields in random order, large
+    contents and decoy fields inside the content and the signature. Every
+    mail is parsed with the mail processor and the result is checked
+    against the fields used to generate it. Time and peak memory are
+    compared with the previous regular expression parser.
+
+    Usage: python3 bench/mailparse.py [--mails N] [--max-size MiB] [--seed N]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import re
+import tempfile
+import tracemalloc
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--mails', type=int, default=50)
+parser.add_argument('--max-size', type=float, default=4,
+    help='maximum size of the content, in MiB')
+parser.add_argument('--seed', type=int, default=0)
+
+DECOYS = ("title: decoy", "TAGS: decoy", "  desc: decoy", "id: 0",
+    "content: nested")
+
+
+def load_mailproc():
+    """ Import mailproc/archivist.py without clashing with the agent. """
+    spec = importlib.util.spec_from_file_location("mailproc_archivist",
+        os.path.join(common.ROOT, "mailproc", "archivist.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def regex_parse(body):
+    """ Previous implementation, kept here as reference. """
+    fields = {}
+    for key in ("id", "title", "desc", "tags"):
+        match = re.search(key + ":(.*)", body, re.IGNORECASE)
+        fields[key] = match.group(1).strip() if match else ""
+
+    match = re.search("content:(.*)/content", body, re.IGNORECASE | re.DOTALL)
+    fields["content"] = match.group(1) if match else ""
+
+    return fields
+
+
+def generate(rnd, path, max_size):
+    """ Write a random mail and return the expected fields. """
+    expected = {
+        "id": str(rnd.randint(1, 10000)),
+        "title": " ".join(rnd.sample(common.WORDS, 4)),
+        "desc": " ".join(rnd.sample(common.WORDS, 8)),
+        "tags": " ".join(rnd.sample(common.WORDS, 3)),
+    }
+
+    lines = []
+    size = rnd.randint(1, int(max_size * 1024 * 1024))
+    while size > 0:
+        if rnd.random() < 0.01:
+            line = rnd.choice(DECOYS)
+        else:
+            line = " ".join(rnd.choice(common.WORDS) for _ in range(12))
+        lines.append(line + "\n")
+        size -= len(line) + 1
+
+    expected["content"] = " " + "".join(lines)
+
+    blocks = ["%s: %s\n" % (key, expected[key])
+        for key in ("id", "title", "desc", "tags")]
+    blocks.append("content:%s/content\n" % expected["content"])
+    rnd.shuffle(blocks)
+
+    with open(path, "w") as f:
+        f.write("\n".join(blocks))
+        f.write("\n-- \nsignature with tags: and /content inside\n")
+
+    return expected
+
+
+def measure(func, *args):
+    """ Return the result, elapsed seconds and peak allocated bytes.
+
+        Memory is traced in a separate run, as tracing slows down the
+        allocation of many small objects.
+    """
+    result, elapsed = common.timed(func, *args)
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    mailproc = load_mailproc()
+    rnd = random.Random(args.seed)
+    path = os.path.join(tempfile.mkdtemp(), "mail.txt")
+
+    totals = {"regex": [0, 0, 0], "lines": [0, 0, 0]}
+
+    for _ in range(args.mails):
+        expected = generate(rnd, path, args.max_size)
+
+        def read_regex():
+            with open(path) as f:
+                return regex_parse(f.read())
+
+        def read_lines():
+            with open(path) as f:
+                return mailproc.parse_body(f)
+
+        for name, func in (("regex", read_regex), ("lines", read_lines)):
+            result, elapsed, peak = measure(func)
+            totals[name][0] += elapsed
+            totals[name][1] = max(totals[name][1], peak)
+            # Only the generated fields are compared, the parsers may
+            # return others (such as 'sections') empty
+            totals[name][2] += all(
+                result.get(key) == value for key, value in expected.items())
+
+    print("%-6s %12s %14s %10s" % ("parser", "time (s)", "peak (MiB)", "correct"))
+
+    for name, (elapsed, peak, correct) in totals.items():
+        print("%-6s %12.2f %14.1f %7d/%d" % (
+            name, elapsed, peak / (1024 * 1024), correct, args.mails))
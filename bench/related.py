@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Related cards benchmark.
+
+    Builds the related cards index of archives of increasing size and
+    measures how long it takes to find the similar cards of a card, both
+    when nothing has changed and to update them after modifying a card.
+    Content of the cards is drawn from a vocabulary with a Zipf
+    distribution, as in natural language text.
+
+    Usage: python3 bench/related.py [--sizes 1000,10000,100000]
+"""
+
+import argparse
+import os
+import itertools
+import random
+import sqlite3
+import tempfile
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', default='1000,10000,100000')
+parser.add_argument('--queries', type=int, default=200)
+parser.add_argument('--vocabulary', type=int, default=20000)
+
+
+def zipf_content(db_path, ncards, nwords, rnd):
+    """ Replace the content of every card with words of a vocabulary in
+        which the frequency of each word is inversely proportional to its
+        rank.
+    """
+    words = ["word%d" % rank for rank in range(1, nwords + 1)]
+    weights = list(itertools.accumulate(
+        1 / rank for rank in range(1, nwords + 1)))
+
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            'UPDATE "card" SET "content" = ? WHERE "id" = ?',
+            ((" ".join(rnd.choices(words, cum_weights=weights, k=60)), cid)
+                for cid in range(1, ncards + 1)))
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    rnd = random.Random(0)
+
+    print("%-10s %12s %12s %12s %12s" % (
+        "cards", "setup (s)", "update (s)", "lookup (ms)", "changed (ms)"))
+
+    for size in [int(n) for n in args.sizes.split(',')]:
+        db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+        common.populate(db_path, size, content_words=0)
+        zipf_content(db_path, size, args.vocabulary, rnd)
+
+        common.load_agent(db_path)
+
+        import store
+
+        # The indexes are built for existing cards when the archive opens
+        ar, setup = common.timed(lambda: store.AgentArchive(
+            db_type="sqlite", db_name=db_path, pool_size=1))
+        _, update = common.timed(ar.related_index.update)
+
+        cids = [rnd.randint(1, size) for _ in range(args.queries)]
+
+        _, lookup = common.timed(
+            lambda: [ar.related_cards(cid) for cid in cids])
+
+        # As the agent does: the card is updated in the background, then
+        # its related cards are requested
+        def changed():
+            for cid in cids:
+                ar.update_card(cid, "bench", desc="changed %d" % cid)
+                ar.related_index.update()
+                ar.related_cards(cid)
+
+        _, modify = common.timed(changed)
+
+        print("%-10d %12.2f %12.2f %12.3f %12.3f" % (
+            size, setup, update, lookup * 1000 / len(cids),
+            modify * 1000 / len(cids)))
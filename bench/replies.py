@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Reply formatting micro-benchmark.
+
+    Formats a section of synthetic cards the way get-section does and
+    compares repeated string concatenation with the reply builder of the
+    agent, both joined into a single mail and split into chat messages.
+
+    Usage: python3 bench/replies.py [--cards 5000] [--content 2000]
+"""
+
+import argparse
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=5000)
+parser.add_argument('--content', type=int, default=2000,
+    help='size of the content of each card, in characters')
+
+FakeCard = namedtuple(
+    "FakeCard", "id title desc content tags modified modified_by")
+
+
+def concat(cards):
+    """ Previous implementation, kept here as reference. """
+    msg = ""
+    for card in cards:
+        part = "\n--------------------\n"
+        part += "[%d] %s" % (card.id, card.title)
+        part += "\n--------------------\n\n"
+        part += "%s\n\n" % card.desc
+        part += "Last modified <%s> - %s\n" % (
+            str(card.modified), card.modified_by)
+        part += "Tags: %s\n\n" % card.tags
+        part += card.content
+        msg += "%s\n\n" % part
+
+    return msg
+
+
+def measure(func, *args):
+    """ Return elapsed milliseconds and peak allocated MiB. """
+    tracemalloc.start()
+    _, elapsed = common.timed(func, *args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed * 1000, peak / (1024 * 1024)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    _, agent = common.load_agent()
+
+    now = datetime.now()
+    cards = [
+        FakeCard(i, "card %d" % i, "description", "x" * args.content,
+            "tag1 tag2", now, "bench")
+        for i in range(args.cards)
+    ]
+
+    runs = (
+        ("concat", lambda: concat(iter(cards))),
+        ("join", lambda: "".join(agent.card_msgs(iter(cards)))),
+        ("split", lambda: agent.split_feedback(
+            agent.card_msgs(iter(cards)), "admin", "jabber")),
+    )
+
+    print("%-8s %12s %12s" % ("method", "time (ms)", "peak (MiB)"))
+
+    for name, func in runs:
+        elapsed, peak = measure(func)
+        print("%-8s %12.1f %12.1f" % (name, elapsed, peak))
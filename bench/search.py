@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Search benchmark.
+
+    Compares the full-text index with the fuzzy search of infocards on
+    archives of increasing size. The fuzzy search is only measured up to
+    '--fuzzy-max' cards, as it scans every card.
+
+    Usage: python3 bench/search.py [--sizes 10000,100000,1000000]
+"""
+
+import argparse
+import os
+import tempfile
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', default='10000,100000,1000000')
+parser.add_argument('--fuzzy-max', type=int, default=10000)
+parser.add_argument('--queries', default='docker,postgres tuning,linux kernel')
+
+
+def consume(results):
+    return len(list(results))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    queries = args.queries.split(',')
+
+    print("%-10s %-10s %12s %12s %12s" % (
+        "cards", "query", "build (s)", "index (ms)", "fuzzy (ms)"))
+
+    for size in [int(n) for n in args.sizes.split(',')]:
+        db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+        common.populate(db_path, size, content_words=10)
+
+        common.load_agent(db_path)
+
+        import store
+
+        # The indexes are built for existing cards when the archive opens
+        ar, build = common.timed(lambda: store.AgentArchive(
+            db_type="sqlite", db_name=db_path, pool_size=1))
+
+        for query in queries:
+            found, indexed = common.timed(
+                lambda: consume(ar.search(query)))
+
+            fuzzy = float("nan")
+            if size <= args.fuzzy_max:
+                _, fuzzy = common.timed(lambda: consume(
+                    store.Archive.search(ar, query)))
+
+            print("%-10d %-10s %12.2f %12.2f %12.2f" % (
+                size, query[:10], build, indexed * 1000, fuzzy * 1000))
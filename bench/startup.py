@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Zoe archivist
+# https://github.com/rmed/zoe-archivist
+#
+# Copyright (c) 2015 Rafael Medina García <rafamedgar@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Agent startup benchmark.
+
+    Imports the agent in a new interpreter with 'python -X importtime',
+    as Zoe does when the agent is started, and shows the modules that
+    took longest to import. Then measures the first messages, the first
+    of which opens the archive and sets up its indexes.
+
+    The agent is started twice: the first time the indexes are created
+    in a database that does not have them yet, the second one shows a
+    restart of the agent.
+
+    Usage: python3 bench/startup.py [--cards 10000] [--top 10]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import common
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cards', type=int, default=10000)
+parser.add_argument('--top', type=int, default=10,
+    help='number of modules to show')
+
+# Run in the new interpreter, with the arguments of this script
+CHILD = """
+import sys, time
+sys.path.insert(0, %r)
+import common
+
+start = time.perf_counter()
+archivist, agent = common.load_agent(sys.argv[1])
+print("startup %%f" %% (time.perf_counter() - start))
+
+for name in ("peewee", "infocards.archive", "fuzzywuzzy.fuzz"):
+    print("loaded %%s %%s" %% (name, name in sys.modules))
+
+for tag, func, args in (
+        ("card-list", agent.card_list, {}),
+        ("search", agent.search, {"query": "docker"}),
+        ("search", agent.search, {"query": "kernel"})):
+    start = time.perf_counter()
+    func(common.FakeParser(sender="admin", src="jabber", **args))
+    print("message %%s %%f" %% (tag, time.perf_counter() - start))
+""" % os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(lines):
+    """ Obtain (cumulative microseconds, module) of every import. """
+    imports = []
+
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.rstrip()))
+
+    return imports
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    common.populate(db_path, args.cards)
+
+    runs = [
+        subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", CHILD, db_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        for _ in range(2)
+    ]
+
+    imports = parse_importtime(runs[1].stderr.splitlines())
+    imports.sort(reverse=True)
+
+    print("%-40s %12s" % ("module", "import (ms)"))
+
+    for cumulative, name in imports[:args.top]:
+        print("%-40s %12.1f" % (name[:40], cumulative / 1000))
+
+    print()
+    print("%-40s %12s %12s" % ("", "first (ms)", "restart (ms)"))
+
+    for first, restart in zip(*(run.stdout.splitlines() for run in runs)):
+        kind, *values = first.split()
+        name = values[0]
+
+        if kind == "startup":
+            name = "agent start"
+
+        elif kind == "loaded":
+            print("%-40s %12s %12s" % (name + " loaded at start",
+                values[1], restart.split()[2]))
+            continue
+
+        print("%-40s %12.1f %12.1f" % (name, float(values[-1]) * 1000,
+            float(restart.split()[-1]) * 1000))
@@ -32,18 +32,26 @@ my $card_list;
 my $card_sections;
 my $delete_card;
 my $delete_sec;
+my $export;
+my $export_section;
 my $get_cards;
 my $get_cards_me;
 my $get_cards_snd;
 my $get_section;
 my $get_section_snd;
+my $import_cards;
 my $new_section;
+my $next_page;
+my $related;
 my $remove_section;
 my $rename_section;
 my $search;
 my $search_section;
 my $section_list;
 my $section_cards;
+my $stats;
+my $tag_cards;
+my $tag_list;
 
 my $sender;
 my $src;
@@ -60,18 +68,26 @@ GetOptions("get"                   => \$get,
            "cs"                    => \$card_sections,
            "dc"                    => \$delete_card,
            "ds"                    => \$delete_sec,
+           "ex"                    => \$export,
+           "exs"                   => \$export_section,
            "gc"                    => \$get_cards,
            "gcm"                   => \$get_cards_me,
            "gcs"                   => \$get_cards_snd,
            "gsm"                   => \$get_section_me,
            "gss"                   => \$get_section_snd,
+           "ic"                    => \$import_cards,
            "ns"                    => \$new_section,
+           "np"                    => \$next_page,
+           "rc"                    => \$related,
            "rs"                    => \$remove_section,
            "rns"                   => \$rename_section,
            "s"                     => \$search,
            "ss"                    => \$search_section,
            "sl"                    => \$section_list,
            "sc"                    => \$section_cards,
+           "st"                    => \$stats,
+           "tc"                    => \$tag_cards,
+           "tl"                    => \$tag_list,
            "string=s"              => \@strings,
            "integer=i"             => \@integers,
            "mail=s"                => \$mail);
@@ -88,6 +104,10 @@ if ($get) {
   &delete_card;
 } elsif ($run and $delete_sec) {
   &delete_section;
+} elsif ($run and $export) {
+  &export;
+} elsif ($run and $export_section) {
+  &export_section;
 } elsif ($run and $get_cards) {
   &get_cards;
 } elsif ($run and $get_cards_me) {
@@ -98,10 +118,16 @@ if ($get) {
   &get_section_me;
 } elsif ($run and $get_section_snd) {
   &get_section_snd;
+} elsif ($run and $import_cards) {
+  &import_cards;
 } elsif ($run and $new_card) {
   &new_card;
 } elsif ($run and $new_section) {
   &new_section;
+} elsif ($run and $next_page) {
+  &next_page;
+} elsif ($run and $related) {
+  &related;
 } elsif ($run and $remove_section) {
   &remove_section;
 } elsif ($run and $rename_section) {
@@ -114,6 +140,12 @@ if ($get) {
   &section_list;
 } elsif ($run and $section_cards) {
   &section_cards;
+} elsif ($run and $stats) {
+  &stats;
+} elsif ($run and $tag_cards) {
+  &tag_cards;
+} elsif ($run and $tag_list) {
+  &tag_list;
 }
 
 #
@@ -125,36 +157,52 @@ sub get {
   print("--cs show /me sections /of /card <integer>\n");
   print("--dc delete /card <integer>\n");
   print("--ds delete /section <string>\n");
+  print("--ex export /all /cards /to <string>\n");
+  print("--exs export /cards /in section <string> /to <string>\n");
   print("--gc show /me card/cards <integer>\n");
   print("--gcm send me card/cards <integer>\n");
   print("--gcs send card/cards <integer> /to <user>\n");
   print("--gsm send me card/cards /in section <string>\n");
   print("--gss send card/cards /in section <string> /to <user>\n");
+  print("--ic import /cards /from <string>\n");
   print("--ns create /new section <string>\n");
+  print("--np /show /me /the next page\n");
+  print("--rc show /me cards related /to /card <integer>\n");
   print("--rs remove /card <integer> /from <string>\n");
   print("--rns rename /section <string> to <string>\n");
   print("--s search /for <string>\n");
   print("--ss search /for <string> /in <string>\n");
   print("--sl show /me /all sections\n");
   print("--sc show /me cards /of /section <string>\n");
+  print("--st show /me /the /archivist stats\n");
+  print("--tc show /me cards /with tag/tags <string>\n");
+  print("--tl show /me /all tags\n");
 
   print("--as añade /la /tarjeta <integer> /a <string>\n");
   print("--cl dame /todas /las tarjetas\n");
   print("--cs dame /las secciones /de /la /tarjeta <integer>\n");
   print("--dc elimina /tarjeta <integer>\n");
   print("--ds elimina /sección <string>\n");
+  print("--ex exporta /todas /las tarjetas /a <string>\n");
+  print("--exs exporta /las tarjetas /de /la sección <string> /a <string>\n");
   print("--gc dame tarjeta/tarjetas <integer>\n");
   print("--gcm envíame tarjeta/tarjetas <integer>\n");
   print("--gcs envía tarjeta/tarjetas <integer> /a <user>\n");
   print("--gsm envíame tarjeta/tarjetas /en /la sección <string>\n");
   print("--gss envía tarjeta/tarjetas /en /la sección <string> /a <user>\n");
+  print("--ic importa /las /tarjetas /de <string>\n");
   print("--ns crea /nueva sección <string>\n");
+  print("--np /dame /la siguiente página\n");
+  print("--rc dame /las tarjetas relacionadas con /la /tarjeta <integer>\n");
   print("--rs quita /la /tarjeta <integer> /de <string>\n");
   print("--rns renombra /la /sección <string> a <string>\n");
   print("--s busca <string>\n");
   print("--ss busca <string> en <string>\n");
   print("--sl dame /todas /las secciones\n");
   print("--sc dame /las tarjetas /de /la /sección <string>\n");
+  print("--st dame /las estadísticas /del /archivista\n");
+  print("--tc dame /las tarjetas con etiqueta/etiquetas <string>\n");
+  print("--tl dame /todas /las etiquetas\n");
 }
 
 #
@@ -192,6 +240,20 @@ sub delete_section {
   print("message dst=archivist&tag=delete-section&name=$strings[0]&sender=$sender&src=$src\n");
 }
 
+#
+# Write every card to a file
+#
+sub export {
+  print("message dst=archivist&tag=export&file=$strings[0]&sender=$sender&src=$src\n");
+}
+
+#
+# Write the cards in a section to a file
+#
+sub export_section {
+  print("message dst=archivist&tag=export&section=$strings[0]&file=$strings[1]&sender=$sender&src=$src\n");
+}
+
 #
 # Get specified cards and send them to specified user by jabber or tg
 #
@@ -227,6 +289,13 @@ sub get_section_snd {
   print("message dst=archivist&tag=get-section&sname=$strings[0]&method=mail&to=$mail&sender=$sender&src=$src\n");
 }
 
+#
+# Import the cards in a CSV or JSON lines file
+#
+sub import_cards {
+  print("message dst=archivist&tag=import-cards&file=$strings[0]&sender=$sender&src=$src\n");
+}
+
 #
 # Create a new section
 #
@@ -234,6 +303,20 @@ sub new_section {
   print("message dst=archivist&tag=new-section&name=$strings[0]&sender=$sender&src=$src\n");
 }
 
+#
+# Show the next page of the last listing
+#
+sub next_page {
+  print("message dst=archivist&tag=next-page&sender=$sender&src=$src\n");
+}
+
+#
+# List the cards most similar to a card
+#
+sub related {
+  print("message dst=archivist&tag=related&cid=$integers[0]&sender=$sender&src=$src\n");
+}
+
 #
 # Remove a card-section relation
 #
@@ -275,3 +358,24 @@ sub section_list {
 sub section_cards {
   print("message dst=archivist&tag=section-cards&name=$strings[0]&sender=$sender&src=$src\n");
 }
+
+#
+# Show usage statistics of the agent
+#
+sub stats {
+  print("message dst=archivist&tag=stats&sender=$sender&src=$src\n");
+}
+
+#
+# List the cards that have the given tags
+#
+sub tag_cards {
+  print("message dst=archivist&tag=tag-cards&query=$strings[0]&sender=$sender&src=$src\n");
+}
+
+#
+# List all tags in the archive
+#
+sub tag_list {
+  print("message dst=archivist&tag=tag-list&sender=$sender&src=$src\n");
+}
@@ -25,7 +25,8 @@
 # SOFTWARE.
 
 import argparse
-import re
+import json
+import tempfile
 
 parser = argparse.ArgumentParser()
 
@@ -33,57 +34,153 @@ parser.add_argument('--mail-subject', dest='subject')
 parser.add_argument('--msg-sender-uniqueid', dest='sender')
 parser.add_argument('--text/plain', dest='text')
 
-if __name__ == '__main__':
-    args, unknown = parser.parse_known_args()
+FIELDS = ('id', 'title', 'desc', 'tags', 'sections')
 
-    # Read mail text
-    with open(args.text, "r") as f:
-        body = f.read()
 
-    cid_re = re.search("id:(.*)", body, re.IGNORECASE)
-    cid = cid_re.group(1).strip() if cid_re else ""
+def parse_body(lines):
+    """ Parse the fields of a card from the lines of a mail body.
 
-    title_re = re.search("title:(.*)", body, re.IGNORECASE)
-    title = title_re.group(1).strip() if title_re else ""
+        Fields are only recognized at the beginning of a line (ignoring
+        case and leading whitespace) and the first occurrence of each one
+        is used. Content starts after 'content:' and ends with the first
+        '/content', so fields inside the content are not mistaken for
+        fields of the card.
 
-    desc_re = re.search("desc:(.*)", body, re.IGNORECASE)
-    desc = desc_re.group(1).strip() if desc_re else ""
+        The body is read in a single pass, one line at a time.
 
-    tags_re = re.search("tags:(.*)", body, re.IGNORECASE)
-    tags = tags_re.group(1).strip() if tags_re else ""
+        Returns a dictionary with the fields found, all of them strings.
+    """
+    fields = dict.fromkeys(FIELDS, '')
+    found = set()
+    content = None
+    in_content = False
 
-    # Content should end with '/content' string to prevent conflicts with
-    # mail signatures
-    content_re = re.search("content:(.*)/content", body,
-        re.IGNORECASE | re.DOTALL)
-    # content = content_re.group(1).strip() if content_re else ""
-    content = ""
-    if content_re:
-        # 'escape' newline
-        content = content_re.group(1).replace('\n', '_NL_')
+    for line in lines:
+        if in_content:
+            pos = line.find('/content')
+            if pos < 0:
+                content.append(line)
+                continue
 
-    if args.subject == "Archivist new":
-        # Create new card
-        print(
-            "message dst=archivist&tag=new-card&title=%s&desc=%s&content=%s&tags=%s&sender=%s" % (
-                title, desc, content, tags, args.sender))
+            content.append(line[:pos])
+            in_content = False
+            continue
+
+        key, sep, value = line.lstrip().partition(':')
+        if not sep:
+            continue
+
+        key = key.lower()
+
+        if key == 'content' and content is None:
+            # Content may also end in the same line
+            pos = value.find('/content')
+            content = [value[:pos] if pos >= 0 else value]
+            in_content = pos < 0
+
+        elif key in FIELDS and key not in found:
+            fields[key] = value.strip()
+            found.add(key)
+
+    if in_content:
+        # Content should end with '/content' string to prevent conflicts
+        # with mail signatures
+        content = None
+
+    fields['content'] = ''.join(content) if content else ''
+
+    return fields
+
+
+def parse_cards(lines):
+    """ Parse several cards from the lines of a mail body.
+
+        Each 'title:' field found outside of a content block starts a new
+        card, and the lines of every card are parsed with parse_body().
+        Parsing stops at the signature delimiter ('-- ') found outside of
+        a content block, so the signature is never read as a card. Only
+        the lines of one card are kept in memory at a time.
 
-    elif args.subject == ("Archivist edit"):
-        # Edit existing card
-        # Only modifies specified values
-        msg = "message dst=archivist&tag=modify-card&cid=%s&sender=%s" % (
-            cid, args.sender)
+        Returns a generator of dictionaries.
+    """
+    block = []
+    has_title = False
+    has_content = False
+    in_content = False
 
-        if title:
-            msg += "&title=" + title
+    for line in lines:
+        if in_content:
+            in_content = '/content' not in line
+            block.append(line)
+            continue
 
-        if desc:
-            msg += "&desc=" + desc
+        if line.rstrip('\r\n') == '-- ':
+            break
 
-        if tags:
-            msg += "&tags=" + tags
+        key, sep, value = line.lstrip().partition(':')
+        key = key.lower() if sep else ''
 
-        if content:
-            msg += "&content=" + content
+        if key == 'title':
+            if has_title:
+                yield parse_body(block)
+                block = []
+                has_content = False
 
-        print(msg)
+            has_title = True
+
+        elif key == 'content' and not has_content:
+            has_content = True
+            in_content = '/content' not in value
+
+        block.append(line)
+
+    if has_title:
+        yield parse_body(block)
+
+
+def handoff_file(suffix):
+    """ Create a temporary file to pass information to the agent.
+
+        The file is not removed when closed, the agent does it once it
+        has been read.
+    """
+    return tempfile.NamedTemporaryFile(
+        "w", prefix="archivist-", suffix=suffix, delete=False)
+
+
+if __name__ == '__main__':
+    args, unknown = parser.parse_known_args()
+
+    if args.subject == "Archivist import":
+        # Store every card in a temporary file that the agent reads and
+        # removes, so that they are all added with a single message
+        with open(args.text, "r") as f, handoff_file(".jsonl") as out:
+            for card in parse_cards(f):
+                out.write(json.dumps(card) + "\n")
+
+        print(
+            "message dst=archivist&tag=import-cards&file=%s&format=jsonl&remove=yes&sender=%s" % (
+                out.name, args.sender))
+
+    elif args.subject in ("Archivist new", "Archivist edit"):
+        # Read mail text
+        with open(args.text, "r") as f:
+            fields = parse_body(f)
+
+        # Fields are stored in a temporary file that the agent reads and
+        # removes, so that they do not need to be escaped in the message
+        with handoff_file(".json") as out:
+            json.dump(fields, out)
+
+        if args.subject == "Archivist new":
+            # Create new card
+            print(
+                "message dst=archivist&tag=new-card&file=%s&remove=yes&sender=%s" % (
+                    out.name, args.sender))
+
+        else:
+            # Edit existing card
+            # Only modifies specified values
+            print(
+                "message dst=archivist&tag=modify-card&cid=%s&file=%s&remove=yes&sender=%s" % (
+                    fields['id'], out.name, args.sender))